@@ -22,6 +22,63 @@
 #                           (now only expose or catalog or both).
 # Zhexing Li    2016-05-11  Added features to include download and time calculation
 #                           of other types of telescope; refined the rest of the code.
+# agent         2026-10-18  Frames are now downloaded concurrently by a bounded pool
+#                           of worker threads (max_workers in the config file).
+# agent         2026-10-18  Frames are streamed to disk in chunks through a temporary
+#                           .part file which is renamed once the frame is complete.
+# agent         2026-10-18  Archive queries now follow the 'next' links of the API so
+#                           that frames beyond the first page are no longer dropped.
+# agent         2026-10-18  The Catalog and TimeLog files are read once per run into
+#                           in-memory indexes for the already-downloaded checks.
+# agent         2026-10-18  Added an optional SQLite backend for the time accounting
+#                           (timelog_backend in the config file).
+# agent         2026-10-18  The TimeLog file is now append-only; 'compact' on the
+#                           command line sorts it back into groups offline.
+# agent         2026-10-18  Only the primary header of each frame is read for the time
+#                           calculation, taken from the download stream if possible.
+# agent         2026-10-18  Headers are read and frame times calculated in a pool of
+#                           worker processes (time_workers in the config file).
+# agent         2026-10-18  Instrument overheads are now read from a table in the config
+#                           file and frame times and totals are computed with NumPy.
+# agent         2026-10-18  Added a checkpoint journal of the state of each frame, so a
+#                           run that died midway is resumed by the next run.
+# agent         2026-10-18  Replaced GetData.lock with one fcntl lock per proposal that
+#                           records its PID and a heartbeat and is reclaimed when stale.
+# agent         2026-10-18  Proposals are processed at the same time by a pool of threads
+#                           sharing one config and one archive session.
+# agent         2026-10-18  Archive traffic goes through a pooled keep-alive session that
+#                           retries 5xx responses and timeouts with backoff and jitter.
+# agent         2026-10-18  The archive token is cached on disk and reused across runs
+#                           until it expires or is refused.
+# agent         2026-10-18  Added an incremental sync mode which only queries frames newer
+#                           than the newest frame already ingested for each obstype.
+# agent         2026-10-18  Site, telescope, instrument, basename and field filters are
+#                           now sent to the archive in a properly encoded query.
+# agent         2026-10-18  Downloads are verified against their checksum, and frames
+#                           already on disk with the same checksum are hard-linked.
+# agent         2026-10-18  Bandwidth and request rate limits per time of day, and
+#                           downloads started in order of priority.
+# agent         2026-10-18  The download log is written through one buffered handle per
+#                           run, optionally as JSON lines with per-frame timings, and
+#                           rotated when it grows too large.
+# agent         2026-10-18  Counters and stage timers for every run, written out as a
+#                           JSON summary and optionally as a Prometheus textfile.
+# agent         2026-10-18  Output_HTML keeps running totals of the TimeLog file and only
+#                           adds up the rows appended since the last run.
+# agent         2026-10-18  The time report adds the time used per night, site,
+#                           instrument and group and a burn rate projection, also
+#                           exported as JSON and CSV.
+# agent         2026-10-18  Frames are moved to the final directories by a pool of
+#                           threads, by rename on the same device and by copy and
+#                           rename across devices; name collisions are resolved and
+#                           each batch is listed in a manifest file.
+# agent         2026-10-18  Added a daemon mode ('daemon' on the command line) which
+#                           polls the archive on an interval set per time of day,
+#                           reloads the config file when it changes and serves its
+#                           status on a local port.
+# agent         2026-10-18  NumPy and astropy are imported only when first used, and a
+#                           proposal with nothing new in the archive is skipped after
+#                           one query; 'benchmark' times runs from the command line.
 #
 ##################################################################################
 
@@ -30,19 +87,81 @@
 # Import necessary modules
 
 import os
-import numpy as np
-from astropy.io import fits
+import importlib
 import requests
 import datetime
 import re
 import shutil
 import sys
+import sqlite3
+import fcntl
+import threading
+import time as clock
+import random
+import hashlib
+import errno
+import heapq
+import json
+import csv
+import multiprocessing
+import atexit
+import signal
+import subprocess
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+
+class Lazy_Module(object):
+    '''
+    Stand-in for a module which is only imported when one of its attributes is first
+    used, so that runs which never read a header or add up times do not pay for
+    importing NumPy and astropy.
+    '''
+
+    def __init__(self,name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self,attr):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+np = Lazy_Module('numpy')
+fits = Lazy_Module('astropy.io.fits')
 
 # Get current time from computer.
     
 time = datetime.datetime.utcnow().strftime("%Y-%m-%d" + "T" + "%H:%M:%S")
 time0 = datetime.datetime.utcnow().strftime("%Y-%m-%d")
 
+# Lock for the checksum index, which is shared by the proposals.
+
+index_lock = threading.Lock()
+
+# Indexes of the Catalog and TimeLog files from the last run, reused by the daemon
+# while the files have not changed.
+
+index_cache = {}
+
+# Header returned for a frame whose header lacks a keyword needed for the time
+# calculation; it has no known instrument, so the frame is logged as such.
+
+unknown_header = ('', 0.0, '', '')
+
 
 ##################################################################################
 #
@@ -54,40 +173,244 @@ def Execute():
     '''
     Function to take output values from Get_Config() function, read the values of
     proposal ID, and execute the functions below one or multiple times depending
-    on how many proposal IDs are entered in the configuration file.
+    on how many proposal IDs are entered in the configuration file. The config file
+    is read and the archive logged in to once, then the proposals are processed by
+    Run_Cycle.
     '''
 
     info = Get_Config()
 
-    # If there're multiple proposal IDs entered in the config file.
-    
-    if ',' in info['proposal']:
-        ids = info['proposal'].split(',')
-        time1m0 = info['total_time(1m0)(hrs)'].split(',')
-        time2m0 = info['total_time(2m0)(hrs)'].split(',')
-        time0m8 = info['total_time(0m8)(hrs)'].split(',')
-        time0m4 = info['total_time(0m4)(hrs)'].split(',')
-        a = 0
-        for items in ids:
-            time1 = time1m0[a]
-            time2 = time2m0[a]
-            time3 = time0m8[a]
-            time4 = time0m4[a]
-            Get_Data(items)
-            Output_HTML(items,time1,time2,time3,time4)
-            a = a + 1
-
-    # If there's only one proposal ID entered in the config file.
+    # Make an authenticated session with the archive, shared by all proposals.
+
+    session = Get_Session(info)
+    auth = Archive_Token(info,session)
+
+    Run_Cycle(info,session,auth)
+
+
+##################################################################################
+#
+# FUNCTION: DAEMON
+#
+##################################################################################
+
+def Daemon():
+    '''
+    Function to run GetData as a long-running process instead of once per cron job.
+    The config, the archive session and its token are kept between cycles and a cycle
+    of Run_Cycle is run every poll_interval(s) seconds, which can be set per window of
+    local hours (e.g. shorter at night while observing). The config file is read again
+    when it changes. Unless health_port is 0, the status of the daemon is served as
+    JSON on that port of localhost. SIGTERM or SIGINT stops the daemon after the
+    current cycle.
+    '''
+
+    global time, time0
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    status = Daemon_Status()
+    server = None
+    info = None
+    config_mtime = None
+
+    while not stop.is_set():
+
+        # Read the config file again and make a new session if it has changed. If it
+        # cannot be read or the archive cannot be logged in to, the daemon goes on
+        # with the old config and tries again on the next cycle.
+
+        try:
+            mtime = os.path.getmtime(Config_Path())
+            if mtime != config_mtime:
+                new_info = Get_Config()
+                new_session = Get_Session(new_info)
+                auth = Archive_Token(new_info,new_session)
+                info = new_info
+                session = new_session
+                config_mtime = mtime
+                status.update(config_loaded = datetime.datetime.utcnow().strftime(
+                    "%Y-%m-%d" + "T" + "%H:%M:%S"))
+        except Exception as e:
+            if info is None:
+                raise
+            status.update(last_result = 'error', last_error = repr(e))
+
+        if server is None and int(info.get('health_port', 0)) > 0:
+            server = Health_Server(int(info['health_port']), status)
+
+        # Each cycle is a run of its own, with its own time for the logs.
+
+        time = datetime.datetime.utcnow().strftime("%Y-%m-%d" + "T" + "%H:%M:%S")
+        time0 = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        status.update(state = 'running', last_start = time)
+
+        try:
+            stats = Run_Cycle(info,session,auth)
+            status.update(last_result = 'ok', last_error = None,
+                          last_summary = stats.summary())
+        except Exception as e:
+            status.update(last_result = 'error', last_error = repr(e))
+
+        interval = Window_Value(Read_Windows(info.get('poll_interval(s)', '600')))
+        if interval <= 0:
+            interval = 600.0
+
+        status.update(state = 'waiting', cycles = status.get('cycles') + 1,
+                      last_end = datetime.datetime.utcnow().strftime(
+                          "%Y-%m-%d" + "T" + "%H:%M:%S"),
+                      next_poll = (datetime.datetime.utcnow() + datetime.timedelta(
+                          seconds = interval)).strftime("%Y-%m-%d" + "T" + "%H:%M:%S"))
+        stop.wait(interval)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+##################################################################################
+#
+# FUNCTION: BENCHMARK
+#
+##################################################################################
+
+def Benchmark(runs = 5):
+    '''
+    Function to time complete runs of the script with the current config file, each in
+    a new interpreter as cron starts it, against the startup of a bare interpreter, and
+    print the median and the slowest of each. The summary of the last run tells whether
+    NumPy and astropy had to be imported.
+    '''
+
+    info = Get_Config()
+    bare = []
+    full = []
+
+    for a in range(runs):
+        start = clock.time()
+        subprocess.call([sys.executable, '-c', 'pass'])
+        bare.append(clock.time() - start)
+        start = clock.time()
+        subprocess.call([sys.executable, os.path.abspath(__file__)])
+        full.append(clock.time() - start)
+
+    bare.sort()
+    full.sort()
+    print("Bare interpreter: median %.3f s, slowest %.3f s" % (bare[runs // 2], bare[-1]))
+    print("GetData run:      median %.3f s, slowest %.3f s" % (full[runs // 2], full[-1]))
+
+    summary_file = info.get('run_summary', info['downloadlog_directory'] +
+                            '/GetData_summary.json')
+    if os.path.exists(summary_file):
+        with open(summary_file,'r') as infile:
+            summary = json.load(infile)
+        print("Modules imported by the last run: " +
+              (', '.join(summary.get('modules', [])) or 'none'))
+
+
+##################################################################################
+#
+# FUNCTION: RUN_CYCLE
+#
+##################################################################################
+
+def Run_Cycle(info,session,auth):
+    '''
+    Function to process all the proposals in the config file once, at the same time
+    by a pool of proposal_workers threads, and write the summary of the run. Returns
+    the Run_Stats of the run.
+    '''
+
+    # Split the proposal IDs and their total times; with only one proposal ID in the
+    # config file each list has a single item.
     
-    else:
-        pro = info['proposal']
-        time1m0 = info['total_time(1m0)(hrs)']
-        time2m0 = info['total_time(2m0)(hrs)']
-        time0m8 = info['total_time(0m8)(hrs)']
-        time0m4 = info['total_time(0m4)(hrs)']
-        Get_Data(pro)
-        Output_HTML(pro,time1m0,time2m0,time0m8,time0m4)       
+    ids = info['proposal'].split(',')
+    time1m0 = info['total_time(1m0)(hrs)'].split(',')
+    time2m0 = info['total_time(2m0)(hrs)'].split(',')
+    time0m8 = info['total_time(0m8)(hrs)'].split(',')
+    time0m4 = info['total_time(0m4)(hrs)'].split(',')
+
+    log = Get_Log(info)
+    stats = Run_Stats()
+
+    pool = ThreadPoolExecutor(max_workers = int(info.get('proposal_workers', 1)))
+    try:
+        futures = []
+        for a in range(len(ids)):
+            futures.append(pool.submit(Run_Proposal,info,session,auth,log,stats,ids[a],
+                                       time1m0[a],time2m0[a],time0m8[a],time0m4[a]))
+        for future in futures:
+            future.result()
+    finally:
+        pool.shutdown()
+        Write_Stats(info, stats)
+        log.close()
+
+    return stats
     
+
+##################################################################################
+#
+# FUNCTION: RUN_PROPOSAL
+#
+##################################################################################
+
+def Run_Proposal(info,session,auth,log,stats,pro_id,time1m,time2m,timept8m,timept4m):
+    '''
+    Function to run Get_Data() and Output_HTML() for one proposal while holding the
+    lock of that proposal. If another run holds the lock, the proposal is skipped, so
+    different proposals can be processed by separate runs at the same time. With
+    fast_check yes, the archive is first asked only for the number of frames and the
+    newest frame of each obstype; if these and the fingerprint of the query, the time
+    allocations and the log files are the same as after the last complete run and no
+    run is left to resume, there is nothing new and the proposal is skipped.
+    '''
+
+    mlog = info['downloadlog_directory'] + '/Marker_' + pro_id + '.txt'
+    jlog = info['downloadlog_directory'] + '/Journal_' + pro_id + '.txt'
+
+    lock = Proposal_Lock(info['downloadlog_directory'] + '/GetData_' + pro_id + '.lock',
+                         float(info.get('lock_ttl(s)', 3600)))
+
+    if not lock.acquire():
+        log.write("Proposal " + pro_id + " is locked by process " +
+                  str(lock.holder()[0]) + ", skipping.", proposal = pro_id,
+                  event = 'skip')
+        stats.count(pro_id, 'proposals_skipped')
+        return
+
+    try:
+        markers = None
+        allocations = [time1m, time2m, timept8m, timept4m]
+        if info.get('fast_check', 'no') == 'yes':
+            markers = Archive_Markers(info,session,auth,pro_id)
+            fingerprint = Proposal_Fingerprint(info, pro_id, allocations)
+            if ((markers, fingerprint) == Read_Markers(mlog) and
+                not os.path.exists(jlog)):
+                log.write("Nothing new for proposal " + pro_id + ", skipping.",
+                          proposal = pro_id, event = 'unchanged')
+                stats.count(pro_id, 'proposals_unchanged')
+                return
+
+        failed = Get_Data(pro_id,info,session,auth,log,stats,lock)
+        lock.touch()
+        Output_HTML(pro_id,time1m,time2m,timept8m,timept4m,info,log,stats)
+
+        # Frames that failed must be tried again by the next run, so the markers are
+        # only kept after a run without failures.
+
+        if markers is not None and failed == 0:
+            Write_Markers(mlog, markers, Proposal_Fingerprint(info, pro_id, allocations))
+    finally:
+        lock.release()
+
+    log.write("Lock file deleted. ", proposal = pro_id)
+    log.write("GetData completed for proposal " + pro_id + ". ", proposal = pro_id,
+              event = 'done')
+    log.flush()
+
     
 ##################################################################################
 #
@@ -95,7 +418,8 @@ def Execute():
 #
 ##################################################################################
 
-def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
+def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m,info = None,log = None,
+                stats = None):
     '''
     Function to read values from the TimeLog.txt file, which contains time spent for
     obtaining each frame. This function adds up times from all the frames in the log
@@ -104,9 +428,17 @@ def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
     '''
     
     # Calls the Get_Config() function to obtain the latest directory which the
-    # TimeLog file belongs to.
+    # TimeLog file belongs to, unless the config has already been read.
     
-    info = Get_Config()
+    if info is None:
+        info = Get_Config()
+
+    own_log = log is None
+    if own_log:
+        log = Get_Log(info)
+
+    if stats is None:
+        stats = Run_Stats()
     
     proposal = pro_id
     One_time = time1m
@@ -115,67 +447,55 @@ def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
     PtFour_time = timept4m
     
     tpath = info['timelog_directory']
-    dpath = info['downloadlog_directory']
 
     tlog = tpath + '/TimeLog_' + proposal + '.txt'
-    dlog = dpath + '/DownloadLog_' + time0 + '.txt'
-    
-    time_1m0 = []
-    time_2m0 = []
-    time_0m8 = []
-    time_0m4 = []
-    
-    with open(dlog,'a') as outfile:
-        outfile.write("Calculating total time used from all frames.\n")
-        
-    with open(tlog,'r') as infile:
-        for line in infile:
-            if not line.startswith('#'):
-                if not line.startswith('\n'):
-                    col = line.split()
-                    if col[2] == "1m0":
-                        time_1m0.append(col[3])
-                    elif col[2] == "2m0":
-                        time_2m0.append(col[3])
-                    elif col[2] == "0m8":
-                        time_0m8.append(col[3])
-                    elif col[2] == "0m4":
-                        time_0m4.append(col[3])
-                    else:
-                        pass
+    tdb = tpath + '/TimeLog_' + proposal + '.db'
+    tsum = tpath + '/TimeSum_' + proposal + '.txt'
     
-    # Check if there's time computed for 1m0, if not, skip 1m0 calculation, if yes, get
-    # total time in seconds and convert it into hours for 1m0, takes 2 decimals.
-    if len(time_1m0) > 0:
-        time_1m0 = map(float,time_1m0)
-        total_time_1m0 = str(np.around((np.sum(time_1m0)/3600.0),decimals = 2))
-    else:
-        total_time_1m0 = "0.00"
+    log.write("Calculating total time used from all frames.", proposal = proposal)
+    stage_start = clock.time()
 
-    # Do the same check on 2m0.
+    # The time used per aperture, night, site, instrument and group is added up by
+    # the TimeLog database, or kept in the TimeSum file and brought up to date with
+    # the rows added to the TimeLog file since the last run.
 
-    if len(time_2m0) > 0:
-        time_2m0 = map(float,time_2m0)
-        total_time_2m0 = str(np.around((np.sum(time_2m0)/3600.0),decimals = 2))
+    if info.get('timelog_backend', 'text') == 'sqlite':
+        conn = Open_TimeDB(tdb)
+        try:
+            breakdowns = Sum_TimeDB(conn)
+        finally:
+            conn.close()
     else:
-        total_time_2m0 = "0.00"
+        breakdowns = Sum_TimeLog(tlog, tsum)
 
-    # Do the same check on 0m8.
-    if len(time_0m8) > 0:
-        time_0m8 = map(float,time_0m8)
-        total_time_0m8 = str(np.around((np.sum(time_0m8)/3600.0),decimals = 2))
-    else:
-        total_time_0m8 = "0.00"
+    totals = breakdowns.get('aperture', {})
+    
+    # Convert the total time in seconds of each aperture into hours, takes 2 decimals;
+    # apertures without any frame have used 0.00 hours.
 
-    # Do the same check on 0m4.
-    if len(time_0m4) > 0:
-        time_0m4 = map(float,time_0m4)
-        total_time_0m4 = str(np.around((np.sum(time_0m4)/3600.0),decimals = 2))
-    else:
-        total_time_0m4 = "0.00"
+    total_time = {}
+
+    for aperture in ['1m0','2m0','0m8','0m4']:
+        if aperture in totals:
+            total_time[aperture] = str(np.around((totals[aperture]/3600.0),decimals = 2))
+        else:
+            total_time[aperture] = "0.00"
 
-    with open(dlog,'a') as outfile:
-        outfile.write("Total time calculation completed.\n")
+    total_time_1m0 = total_time['1m0']
+    total_time_2m0 = total_time['2m0']
+    total_time_0m8 = total_time['0m8']
+    total_time_0m4 = total_time['0m4']
+
+    log.write("Total time calculation completed.", proposal = proposal, event = 'totals',
+              **dict(('hours_' + aperture, float(total_time[aperture])) for aperture
+                     in total_time))
+
+    # Project the use of each allocation and render the breakdowns for the report.
+
+    window = int(info.get('burn_window(nights)', 7))
+    burn = Burn_Rate(breakdowns, {'1m0': One_time, '2m0': Two_time, '0m8': PtEight_time,
+                                  '0m4': PtFour_time}, window)
+    tables = Report_Tables(breakdowns, burn, window)
         
     # Output the result to a HTML file.
 
@@ -194,6 +514,7 @@ def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
             if PtFour_time != 'NONE':
                 outfile.write("<strong>0m4 Time Used/Allocated: %s of %s hrs</strong><br>"
                               % (total_time_0m4,PtFour_time))
+            outfile.write(tables)
             outfile.write("</body></html>")
     else:
         with open(tpath + '/Time_' + proposal + '.html','a') as outfile:
@@ -210,22 +531,16 @@ def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
             if PtFour_time != 'NONE':
                 outfile.write("<strong>0m4 Time Used/Allocated: %s of %s hrs</strong><br>"
                               % (total_time_0m4,PtFour_time))
+            outfile.write(tables)
             outfile.write("</body></html>")
 
-    with open(dlog,'a') as outfile:
-        outfile.write("Time used updated in HTML file.\n")
+    Write_Report(tpath + '/Time_' + proposal, proposal, breakdowns, burn)
 
-    # Delete the lock file in the log directory.
-    
-    for files in os.listdir(dpath):
-        if files.endswith(".lock"):
-            os.remove(dpath + '/' + files)
-        else:
-            pass
+    log.write("Time used updated in HTML file.", proposal = proposal)
+    stats.add_time(proposal, 'html', clock.time() - stage_start)
 
-    with open(dlog,'a') as outfile:
-        outfile.write("Lock file deleted. \n")
-        outfile.write("GetData completed for proposal " + proposal + ". \n")
+    if own_log:
+        log.close()
 
 
 ##################################################################################
@@ -234,64 +549,89 @@ def Output_HTML(pro_id,time1m,time2m,timept8m,timept4m):
 #
 ##################################################################################
 
-def Get_Data(pro_id):
+def Get_Data(pro_id,info = None,session = None,auth = None,log = None,stats = None,
+             lock = None):
     '''
     Main function to query over LCOGT's archive and download frames with requested
     information found in the configuration file, which is called at the beginning
     of this function. Meanwhile, it calculates the time used for obtaining each
     frame and returns the total time allocation that have been used to obatin all
-    the frames downloaded.
+    the frames downloaded. The config, the HTTP session and the archive token can be
+    passed in so that several proposals share them; otherwise the config file is read
+    and the archive token is set up here. The Proposal_Lock held for the proposal, if
+    any, is touched as frames are processed. Returns the number of frames that failed
+    to download or move.
     '''
     
     # Get key information from configuration file.
     
-    info = Get_Config()
+    if info is None:
+        info = Get_Config()
     
-    archive = info['archive']
-    api_token = info['api_token']
-    api_frames = info['api_frames']
-    username = info['username']
-    password = info['password']
     proposal = pro_id
     date_start = info['date_start']
     date_end = info['date_end']
     rlevel = info['rlevel']
     obstype = info['obstype']
-    path1 = info['frame_directory']
+    path1 = info['frame_directory'] + '/' + pro_id
     path2 = info['downloadlog_directory']
     path3 = info['timelog_directory']
     path4 = info['finalframe_directory']
     path5 = info['finalproducts_directory']
+    timelog_backend = info.get('timelog_backend', 'text')
+    max_workers = int(info.get('max_workers', 4))
+    time_workers = int(info.get('time_workers', 1))
+    overheads = Read_Overheads(info)
+    chunk_size = int(info.get('chunk_size(bytes)', 1048576))
+    move_workers = int(info.get('move_workers', 4))
+    sync_mode = info.get('sync_mode', 'full')
+    sync_overlap = float(info.get('sync_overlap(hrs)', 1.0))
+    priority = info.get('download_priority', 'NONE')
     data_type = ''
 
-    # Check if there's a lock file in the directory, if there's not, create one and continue
-    # the rest of the code; if there's is one, stop the rest of the code.
+    if priority == 'NONE':
+        priority = obstype
+
+    touch = lock.touch if lock is not None else (lambda: None)
+
+    # Each proposal works in its own subdirectory of the frame directory.
+
+    if not os.path.exists(path1):
+        os.makedirs(path1)
 
-    if os.path.exists(path2 + '/GetData.lock'):
-        sys.exit(0)
-    else:
-        with open(path2 + '/GetData.lock','w') as lockfile:
-            lockfile.write(time)
-            
     # Creat and open files for logging downloaded frame names, their obs id and,
-    # their total observation time, and move it to desired directory; if already
-    # existed, append current time to file.
+    # their total observation time, and move it to desired directory; the download
+    # log is opened once per run, unless it has already been opened.
+
+    own_log = log is None
+    if own_log:
+        log = Get_Log(info)
+
+    own_stats = stats is None
+    if own_stats:
+        stats = Run_Stats()
 
-    dlog = path2 + '/DownloadLog_' + time0 + '.txt'
     clog = path2 + '/Catalog_' + proposal + '.txt'
     tlog = path3 + '/TimeLog_' + proposal + '.txt'
+    tdb = path3 + '/TimeLog_' + proposal + '.db'
+    jlog = path2 + '/Journal_' + proposal + '.txt'
+    slog = path2 + '/Sync_' + proposal + '.txt'
+    xlog = info.get('checksum_index', path2 + '/Checksum_index.txt')
+    mpath = info.get('manifest_directory', path2)
+
+    log.write("Lock file created.", proposal = proposal, event = 'start')
     
-    if os.path.exists(dlog):
-        with open(dlog,'a') as outfile:
-            outfile.write("\n" + "\n" + time + "\n" + "\n")
-            outfile.write("Lock file created." + "\n")
-    else:
-        with open(dlog,'w') as outfile:
-            outfile.write("##### GetData Download Logfile #####" + "\n" + "\n")
-            outfile.write(time + "\n" + "\n")
-            outfile.write("Lock file created." + "\n")
-    
-    if os.path.exists(tlog):
+    # With the SQLite backend, the time accounting goes to the TimeLog database; an
+    # existing TimeLog file is imported into it until an import has been completed.
+
+    if timelog_backend == 'sqlite':
+        conn = Open_TimeDB(tdb)
+        imported = conn.execute("SELECT value FROM meta WHERE key = 'imported'")
+        if imported.fetchone() is None:
+            Import_TimeLog(conn, tlog)
+            if os.path.exists(tlog):
+                log.write("Imported " + tlog + " into " + tdb + ".", proposal = proposal)
+    elif os.path.exists(tlog):
         pass
     else:
         with open(tlog,'w') as outfile:
@@ -299,6 +639,16 @@ def Get_Data(pro_id):
             outfile.write("# Group Name" + "     " + "File Name" + "     " +
                           "Instrument Name" + "     " + "Total Observation Time" + "\n")
 
+    # Read the Catalog and TimeLog files once into indexes of file names and group
+    # names, which are kept up to date below as new frames are logged; the daemon
+    # reuses the indexes of the last cycle if the files have not changed.
+
+    catalog_files = Cached_Index(clog, Read_Catalog)
+    if timelog_backend == 'sqlite':
+        timelog_files, timelog_groups = Read_TimeDB(conn)
+    else:
+        timelog_files, timelog_groups = Cached_Index(tlog, Read_TimeLog)
+
     # Fetching data type from the configuraton file input.
     
     if rlevel == 'raw':
@@ -311,26 +661,45 @@ def Get_Data(pro_id):
         rlevel = '91'
         data_type = '.fz'
     else:
-        with open(dlog,'a') as outfile:
-            outfile.write("Unknown data type from the configuration file. \n")
+        log.write("Unknown data type from the configuration file. ", proposal = proposal)
+
+    # Cleaning frame directory to remove unexpected files in it. Frames that a previous
+    # run of this proposal downloaded completely but did not move (it died midway) are
+    # kept according to the journal, and that run is resumed from where it stopped.
+
+    journal = Read_Journal(jlog)
+    resumable = set()
 
-    # Cleaning frame directory to remove unexpected files in it.
+    # The journal is opened once for the run and every state change is written through
+    # this handle, flushed line by line so a run that dies leaves a complete journal.
+
+    jfile = open(jlog,'a')
 
     for files in os.listdir(path1):
-        if files.endswith(data_type):
+        if files.endswith(data_type + '.part'):
             os.remove(path1 + '/' + files)
+        elif files.endswith(data_type):
+            if journal.get(files, [''])[0] in ['downloaded','parsed','logged']:
+                resumable.add(files)
+            else:
+                os.remove(path1 + '/' + files)
         else:
             pass
-    
-    # Make an authenticated request to the archive.
 
-    with open(dlog,'a') as outfile:
-        outfile.write("Log in to LCOGT archive..." + "\n")
+    if len(resumable) > 0:
+        log.write("Resuming previous run with " + str(len(resumable)) +
+                  " frames already downloaded.", proposal = proposal, event = 'resume',
+                  frames = len(resumable))
+        stats.count(proposal, 'frames_resumed', len(resumable))
     
-    response = requests.post(archive + api_token,data =
-                             {'username': username,'password': password}).json()
-    token = response.get('token')
-    headers = {'Authorization': 'Token ' + token}
+    # Make an authenticated request to the archive, unless it has already been made.
+
+    if session is None:
+        session = Get_Session(info)
+
+    if auth is None:
+        log.write("Log in to LCOGT archive...", proposal = proposal)
+        auth = Archive_Token(info,session)
 
     # Download desired data from the archive, skip those which have already been
     # downloaded.
@@ -342,18 +711,52 @@ def Get_Data(pro_id):
     else:
         type_list.append(obstype)
 
+    # Frames to download are put in a priority queue while the archive is queried,
+    # and a pool of worker threads takes the most urgent frame from it each time one
+    # of them is free, so the downloads go on while the next pages are requested. The
+    # archive pages by offset, so a frame may come back on two pages; it is only
+    # queued once. The download log is written once all the downloads have finished.
+
+    pool = ThreadPoolExecutor(max_workers = max_workers)
+    queue = Download_Queue(priority.split(','))
+    downloads = []
+    queued = set()
+    failed = 0
+    header_blocks = {}
+    checksums = {}
+    checksum_index = Read_Checksums(xlog)
+
+    # Keep track of the observation date of each frame and of the newest frame of
+    # each obstype, from which the next incremental run starts.
+
+    sync_marks = Read_Sync(slog)
+    frame_dates = {}
+    newest = {}
+
     for items in type_list:
-        with open(dlog,'a') as outfile:
-            outfile.write("Log in successful, downloading requested files for proposal "
-                           + proposal + "..." + "\n")
+        log.write("Log in successful, downloading requested files for proposal " +
+                  proposal + "...", proposal = proposal)
     
-        response = requests.get(archive + api_frames + '?start=' + date_start + '&end='
-                                + date_end + '&RLEVEL=' + rlevel + '&PROPID=' + proposal
-                                + '&OBSTYPE=' + items, headers = headers).json()
-        
-        frames = response['results']
+        # In incremental mode, only ask for the frames observed after the newest frame
+        # of this obstype that has already been ingested, less the overlap.
+
+        start = date_start
+        if sync_mode == 'incremental' and items in sync_marks:
+            start = Sync_Start(date_start, sync_marks[items], sync_overlap)
+            log.write("Incremental sync of " + items + " frames from " + start + ".",
+                      proposal = proposal, event = 'sync', obstype = items, start = start)
+
+        query = Frame_Query(info, start, rlevel, proposal, items)
+        query_start = clock.time()
+        found = 0
+
+        for frame in Query_Frames(session, query, auth):
+            touch()
+            found = found + 1
+            if frame.get('DATE_OBS'):
+                frame_dates[frame['filename']] = (items, frame['DATE_OBS'][0:19])
+                newest[items] = max(newest.get(items, ''), frame['DATE_OBS'][0:19])
 
-        for frame in frames:
             if frame['filename'].endswith('e' + rlevel+ '.fits' + data_type):
                 if os.path.exists(clog):
                     pass
@@ -361,307 +764,2701 @@ def Get_Data(pro_id):
                     with open(clog,'w') as outfile:
                         outfile.write("##### GetData Catalog Logfile #####" + "\n" + "\n")
                         outfile.write("# File Name" + "\n")
-                        
-                log = open(clog, 'r')
-                num = []
-                try:
-                    for line in log:
-                        if not line.startswith('#'):
-                            if not line.startswith('\n'):
-                                col = line.split()
-                                if col[0] == frame['filename']:
-                                    num.append(col[0])
-                                    break
-                                else:
-                                    pass
-                finally:
-                    log.close()
 
         # Download frames that haven't been downloaded yet.
         
-                if len(num) == 0:
-                    with open(path1 + '/' + frame['filename'],'wb') as f:      
-                        f.write(requests.get(frame['url']).content)
-                    with open(dlog,'a') as outfile:
-                        outfile.write(str(frame['filename']) + " successfully downloaded." +
-                                      "\n")
+                if frame['filename'] in resumable or frame['filename'] in queued:
+                    pass
+
+                elif frame['filename'] not in catalog_files:
+                    Write_Journal(jfile, 'listed', frame['filename'])
+                    queue.put(items, frame)
+                    queued.add(frame['filename'])
+                    downloads.append(pool.submit(Fetch_Next, queue, path1, chunk_size,
+                                                 session, checksum_index))
 
         # Skip frames that have already been downloaded.
         
                 else:
-                    with open(dlog,'a') as outfile:
-                        outfile.write("Skipping " + str(frame['filename']) + ", already " +
-                                      "exists." + "\n")
+                    log.write("Skipping " + str(frame['filename']) + ", already exists.",
+                              proposal = proposal)
+                    stats.count(proposal, 'frames_skipped')
 
             elif frame['filename'].endswith(data_type):
                 if not frame['filename'].endswith('e' + rlevel+ '.fits' + data_type):
-                    log = open(tlog, 'r')
-                    num = []
-                    try:
-                        for line in log:
-                            if not line.startswith('#'):
-                                if not line.startswith('\n'):
-                                    col = line.split()
-                                    if col[1] == frame['filename']:
-                                        num.append(col[1])
-                                        break
-                                    else:
-                                        pass
-                    finally:
-                        log.close()
 
         # Download frames that haven't been downloaded yet.
         
-                    if len(num) == 0:
-                        with open(path1 + '/' + frame['filename'],'wb') as f:      
-                            f.write(requests.get(frame['url']).content)
-                        with open(dlog,'a') as outfile:
-                            outfile.write(str(frame['filename']) + " successfully downloaded." +
-                                          "\n")
+                    if frame['filename'] in resumable or frame['filename'] in queued:
+                        pass
+
+                    elif frame['filename'] not in timelog_files:
+                        Write_Journal(jfile, 'listed', frame['filename'])
+                        queue.put(items, frame)
+                        queued.add(frame['filename'])
+                        downloads.append(pool.submit(Fetch_Next, queue, path1, chunk_size,
+                                                     session, checksum_index))
 
         # Skip frames that have already been downloaded.
         
                     else:
-                        with open(dlog,'a') as outfile:
-                            outfile.write("Skipping " + str(frame['filename']) + ", already " +
-                                          "exists." + "\n")
+                        log.write("Skipping " + str(frame['filename']) + ", already " +
+                                  "exists.", proposal = proposal)
+                        stats.count(proposal, 'frames_skipped')
+
+        log.write(None, proposal = proposal, event = 'query', obstype = items,
+                  frames = found, seconds = round(clock.time() - query_start, 3))
+        stats.count(proposal, 'frames_listed', found)
+        stats.add_time(proposal, 'query', clock.time() - query_start)
+
+    # Wait for all downloads to finish. A frame that failed to download is removed by
+    # Download_Frame, so only fully written frames are left in the frame directory.
+
+    for future in as_completed(downloads):
+        touch()
+        files, result, error = future.result()
+        if error is None:
+            blocks, checksum, source, seconds = result
+            header_blocks[files] = blocks
+            checksums[files] = checksum
+            Write_Journal(jfile, 'downloaded', files)
+            size = os.path.getsize(path1 + '/' + files)
+            if source is None:
+                log.write(str(files) + " successfully downloaded.",
+                          proposal = proposal, event = 'download', frame = files,
+                          bytes = size, seconds = round(seconds, 3),
+                          bytes_per_s = round(size / max(seconds, 1e-6)))
+                stats.count(proposal, 'frames_downloaded')
+                stats.count(proposal, 'bytes_downloaded', size)
+                stats.sample(proposal, 'download', seconds)
+            else:
+                log.write(str(files) + " linked to identical frame " + source +
+                          ".", proposal = proposal, event = 'link',
+                          frame = files, bytes = size,
+                          seconds = round(seconds, 3))
+                stats.count(proposal, 'frames_linked')
+        else:
+            log.write("Failed to download " + str(files) + ": " + str(error),
+                      proposal = proposal, event = 'error', frame = files)
+            stats.count(proposal, 'frames_failed')
+            failed = failed + 1
+
+            # The next incremental run must query this frame again.
+
+            if files in frame_dates:
+                items, date_obs = frame_dates[files]
+                newest[items] = min(newest[items], date_obs)
+
+    # The download stage runs from the first frame queued until the last download has
+    # finished, so it overlaps the query of the pages after the first frame.
+
+    pool.shutdown()
+    if queue.started is not None:
+        stats.add_time(proposal, 'download', clock.time() - queue.started)
         
-    with open(dlog,'a') as outfile:
-        outfile.write("All frames are downloaded." + "\n")
+    log.write("All frames are downloaded.", proposal = proposal)
 
     for files in os.listdir(path1):
         if files.endswith('e' + rlevel+ '.fits' + data_type):
-            with open(clog,'a') as outfile:
-                outfile.write(str(files) + "\n")
+            if files not in catalog_files:
+                with open(clog,'a') as outfile:
+                    outfile.write(str(files) + "\n")
+                catalog_files.add(files)
 
     # Go through each fits file in the directory to get information from the header
     # and write info to the logs; if already done so for some frames, skip them.
 
-    if rlevel == '10':
-        with open(dlog,'a') as outfile:
-            outfile.write("Calculating time used for each frame..." + "\n")
+    if rlevel == '11':
+        log.write("Calculating time used for each frame...", proposal = proposal)
+
+        new_files = []
         
-        for files in os.listdir(path1):
+        for files in sorted(os.listdir(path1)):
             if files.endswith(data_type):
                 if not files.endswith('e' + rlevel+ '.fits' + data_type):
-                    group_name = []
-                    file_name = []
-                    obstime = []
-        
-                    log = open(tlog,'r')
-                    try:
-                        for line in log:
-                            if not line.startswith('#'):
-                                if not line.startswith('\n'):
-                                    col = line.split()
-                                    if  col[1] == files:
-                                        file_name.append(col[1])
-                                        break
-                                    else:
-                                        pass
-                    finally:
-                        log.close()
-                
-            # Calculate time for file that hasn't been calculated before.
+                    if files not in timelog_files:
+                        new_files.append(files)
             
-                    if len(file_name) == 0:
-                        hdulist = fits.open(path1 + '/' + files)
-                        group = hdulist[0].header['GROUPID']
-                        exptime = hdulist[0].header['EXPTIME']
-                        instru = hdulist[0].header['INSTRUME']
-                        aperture = hdulist[0].header['TELID']
-
-                        with open(tlog,'r') as infile:
-                            for line in infile:
-                                if not line.startswith('#'):
-                                    if not line.startswith('\n'):
-                                        col = line.split()
-                                        if col[0] == group:
-                                            group_name.append(col[0])
-                                            break
-                                        else:
-                                            pass
-                                
-                # Calculate time for frames that belongs to a group which already
-                # exists in the log file.
-                
-                        if len(group_name) == 1:
-                            if instru [0:2] == 'fl':
-                                obstime.append(float(exptime) + 2.0 + 37.0 + 1.0)
-                            elif instru [0:2] == 'kb':
-                                obstime.append(float(exptime) + 2.0 + 14.5 + 1.0)
-                            elif instru [0:2] == 'fs':
-                                obstime.append(float(exptime) + 2.0 + 10.5 + 12.0)
-                            else:
-                                pass
-                        
-                # Calculate time for frames that belongs to a group which is not in
-                # the log file yet (first appearance for a group).
-                
-                        elif len(group_name) == 0:
-                            if instru [0:2] == 'fl':
-                                obstime.append(float(exptime) + 90.0 + 2.0 + 37.0 + 1.0)
-                            elif instru [0:2] == 'kb':
-                                obstime.append(float(exptime) + 90.0 + 2.0 + 14.5 + 1.0)
-                            elif instru [0:2] == 'fs':
-                                obstime.append(float(exptime) + 240.0 + 2.0 + 10.5 + 12.0)
-                            else:
-                                pass
-                        else:
-                            pass
+            # Append comments to the log file for frames which time has already been
+            # calculated.
+            
+                    else:
+                        log.write("Time already calculated for " + str(files) + ".",
+                                  proposal = proposal)
+            else:
+                pass
 
-                # Append time information to the log file for frames that make first
-                # appearance for a specific observation group.
-                
-                        if len(obstime) == 1 and len(group_name) == 0:
+        # Read the headers of the new frames in a pool of worker processes. The
+        # results come back in the (sorted) order of new_files, so they are logged
+        # below in the same order as with a single process. Headers already parsed
+        # by a previous run are taken from the journal.
 
-                            with open(dlog,'a') as outfile:
-                                outfile.write("Time calculated for new frame " + str(files) +
-                                              "." + "\n")
-                    
-                            with open(tlog, 'a') as outfile:
-                                if aperture[0:3] == '2m0':
-                                    outfile.write(str(group) + "     " + str(files) + "     "
-                                                  + '2m0' + "     " + str(obstime[0]) + "\n")
-                                elif aperture[0:3] == '1m0':
-                                    outfile.write(str(group) + "     " + str(files) + "     "
-                                                  + '1m0' + "     " + str(obstime[0]) + "\n")
-                                elif aperture[0:3] == '0m8':
-                                    outfile.write(str(group) + "     " + str(files) + "     "
-                                                  + '0m8' + "     " + str(obstime[0]) + "\n")
-                                elif aperture[0:3] == '0m4':
-                                    outfile.write(str(group) + "     " + str(files) + "     "
-                                                  + '0m4' + "     " + str(obstime[0]) + "\n")
-                                else:
-                                    pass
-
-                # Append time information to the log file for frames that belong to
-                # a specific observation group.
+        parse_files = [files for files in new_files if journal.get(files, [''])[0] !=
+                       'parsed']
+        blocks = [header_blocks.get(files) for files in parse_files]
+        stage_start = clock.time()
+
+        if time_workers > 1 and len(parse_files) > 1:
+            tpool = Process_Pool(time_workers)
+            try:
+                parsed = list(tpool.map(Timed_Header, [path1 + '/' + files for files
+                                                       in parse_files], blocks))
+            finally:
+                tpool.shutdown()
+        else:
+            parsed = [Timed_Header(path1 + '/' + files, block) for files, block
+                      in zip(parse_files, blocks)]
+
+        for files, (frame_header, seconds) in zip(parse_files, parsed):
+            touch()
+            log.write(None, proposal = proposal, event = 'parse', frame = files,
+                      seconds = round(seconds, 4))
+            stats.sample(proposal, 'parse', seconds)
+            Write_Journal(jfile, 'parsed', files, frame_header)
+            journal[files] = ['parsed', frame_header[0], str(frame_header[1]),
+                              frame_header[2], frame_header[3]]
+
+        frame_headers = [(journal[files][1], float(journal[files][2]), journal[files][3],
+                          journal[files][4]) for files in new_files]
+
+        stats.add_time(proposal, 'parse', clock.time() - stage_start)
+        stage_start = clock.time()
+
+        # Calculate the times of all the new frames at once from the overhead table.
+
+        frame_times = Frame_Times(frame_headers, timelog_groups, overheads)
+
+        for files, frame_header, frame_time in zip(new_files, frame_headers, frame_times):
+            touch()
+            group, exptime, instru, aperture = frame_header
+            obstime = []
+
+                # Frames of an unknown class of instrument have no time.
+
+            if not np.isnan(frame_time):
+                obstime.append(float(frame_time))
+
+                # With the SQLite backend, insert the frame and its group into the
+                # database in a single transaction.
+
+            if len(obstime) == 1 and timelog_backend == 'sqlite':
+
+                if aperture[0:3] in ['2m0','1m0','0m8','0m4']:
+                    log.write("Time calculated for new frame " + str(files) + ".",
+                              proposal = proposal, event = 'time', frame = files,
+                              aperture = aperture[0:3], obstime = obstime[0])
+
+                    Insert_TimeDB(conn, group, files, aperture[0:3], obstime[0])
+                    Write_Journal(jfile, 'logged', files)
+                    timelog_files.add(files)
+                    timelog_groups.add(group)
+
+                # Append time information to the end of the log file. Frames of a group
+                # that is already in the log are appended too instead of rewriting the
+                # whole file; Compact_TimeLog puts the rows of each group back together.
                 
-                        elif len(obstime) == 1 and len(group_name) == 1:
+            elif len(obstime) == 1:
 
-                            with open(dlog,'a') as outfile:
-                                outfile.write("Time calculated for new frame " + str(files) +
-                                              "." + "\n")
+                log.write("Time calculated for new frame " + str(files) + ".",
+                          proposal = proposal, event = 'time', frame = files,
+                          aperture = aperture[0:3], obstime = obstime[0])
                     
-                            temp = open(path3 + '/temp','wb')
-                            with open (tlog,'r') as f:
-                                a = 0
-                                for line in f:
-                                    if not line.startswith('#'):
-                                        if not line.startswith('\n'):
-                                            col = line.split()
-                                            if col[0] == group_name[0]:
-                                                if a == 0:
-                                                    if aperture[0:3] == '2m0':
-                                                        line = (line.strip() + "\n" + str(group)
-                                                                + "     " + str(files) + "     "
-                                                                + "2m0" + "     " +
-                                                                str(obstime[0]) + "\n")
-                                                    elif aperture[0:3] == '1m0':
-                                                        line = (line.strip() + "\n" + str(group)
-                                                                + "     " + str(files) + "     "
-                                                                + "1m0" + "     " +
-                                                                str(obstime[0]) + "\n")
-                                                    elif aperture[0:3] == '0m8':
-                                                        line = (line.strip() + "\n" + str(group)
-                                                                + "     " + str(files) + "     "
-                                                                + "0m8" + "     " +
-                                                                str(obstime[0]) + "\n")
-                                                    elif aperture[0:3] == '0m4':
-                                                        line = (line.strip() + "\n" + str(group)
-                                                                + "     " + str(files) + "     "
-                                                                + "0m4" + "     " +
-                                                                str(obstime[0]) + "\n")
-                                                    else:
-                                                        pass
-                                                
-                                                    a = a + 1
-                                                else:
-                                                    pass
-                                            else:
-                                                pass
-                                    temp.write(line)
-                            temp.close()
-                            shutil.move(path2 + '/temp',tlog)
+                with open(tlog, 'a') as outfile:
+                    if aperture[0:3] == '2m0':
+                        outfile.write(str(group) + "     " + str(files) + "     "
+                                      + '2m0' + "     " + str(obstime[0]) + "\n")
+                    elif aperture[0:3] == '1m0':
+                        outfile.write(str(group) + "     " + str(files) + "     "
+                                      + '1m0' + "     " + str(obstime[0]) + "\n")
+                    elif aperture[0:3] == '0m8':
+                        outfile.write(str(group) + "     " + str(files) + "     "
+                                      + '0m8' + "     " + str(obstime[0]) + "\n")
+                    elif aperture[0:3] == '0m4':
+                        outfile.write(str(group) + "     " + str(files) + "     "
+                                      + '0m4' + "     " + str(obstime[0]) + "\n")
+                    else:
+                        pass
+
+                if aperture[0:3] in ['2m0','1m0','0m8','0m4']:
+                    Write_Journal(jfile, 'logged', files)
+                    timelog_files.add(files)
+                    timelog_groups.add(group)
 
                 # Append comments to the log file for frames that have unknown class
                 # of instrument.
                 
-                        else:
-                            with open(dlog,'a') as outfile:
-                                outfile.write("Unknown class of instrument for frame " +
-                                              str(files) + ".\n")
-            
-            # Append comments to the log file for frames which time has already been
-            # calculated.
-            
-                    else:
-                        with open(dlog,'a') as outfile:
-                            outfile.write("Time already calculated for " + str(files) +
-                                          "." + "\n")
             else:
-                pass
+                log.write("Unknown class of instrument for frame " + str(files) + ".",
+                          proposal = proposal, event = 'error', frame = files)
+
+        # Write the time used by the new frames of each aperture to the download log.
 
-        with open(dlog,'a') as outfile:
-            outfile.write("Time calculation for all frames completed." + "\n")
+        apertures = [frame_header[3][0:3] for frame_header in frame_headers]
+        logged = ~np.isnan(frame_times) & np.isin(apertures, ['2m0','1m0','0m8','0m4'])
+        new_totals = Sum_Times(apertures, frame_times, logged)
+
+        for aperture in sorted(new_totals):
+            log.write("Time used by new " + aperture + " frames: " +
+                      str(np.around(new_totals[aperture], decimals = 1)) + " s.",
+                      proposal = proposal, event = 'new_time', aperture = aperture,
+                      seconds = float(new_totals[aperture]))
+        log.write("Time calculation for all frames completed.", proposal = proposal)
+        stats.count(proposal, 'frames_timed', int(np.sum(logged)))
+        stats.add_time(proposal, 'timelog', clock.time() - stage_start)
 
     else:
-        with open(dlog,'a') as outfile:
-            outfile.write("Not quicklook data, no time calculation is needed." + "\n")
+        log.write("Not quicklook data, no time calculation is needed.",
+                  proposal = proposal)
+
+    if timelog_backend == 'sqlite':
+        conn.close()
 
-    # Move all frames to output directory and ready for use by other programs.
+    # Move all frames to output directory and ready for use by other programs, in a
+    # pool of worker threads since a move to another device is a full copy. Once all
+    # the moves have finished, the frames moved are listed in a manifest.
+
+    stage_start = clock.time()
+    mpool = ThreadPoolExecutor(max_workers = move_workers)
+    moves = {}
+    manifest = []
 
     for files in os.listdir(path1):
         if files.endswith(data_type):
             if not files.endswith('e' + rlevel+ '.fits' + data_type):
-	    	dest = os.path.join(path4, files)
-		if os.path.isfile(dest) == False:
-                    shutil.move(path1 + '/' + files, path4)
+                future = mpool.submit(Move_Frame, path1 + '/' + files, path4,
+                                      checksums.get(files), chunk_size)
+                moves[future] = files
             elif files.endswith('e' + rlevel+ '.fits' + data_type):
-	    	dest = os.path.join(path5, files)
-		if os.path.isfile(dest) == False:
-                    shutil.move(path1 + '/' + files, path5)
+                future = mpool.submit(Move_Frame, path1 + '/' + files, path5,
+                                      checksums.get(files), chunk_size)
+                moves[future] = files
             else:
                 pass
 
-    with open(dlog,'a') as outfile:
-        outfile.write("Frames moved to output directory, ready for use.\n")
+    for future in as_completed(moves):
+        touch()
+        files = moves[future]
+        try:
+            dest, action, checksum, seconds = future.result()
+        except Exception as e:
+            log.write("Failed to move " + files + ": " + str(e), proposal = proposal,
+                      event = 'error', frame = files)
+            stats.count(proposal, 'frames_failed')
+            failed = failed + 1
+            continue
+
+        Write_Journal(jfile, 'moved', files)
+        log.write(None, proposal = proposal, event = 'move', frame = files, dest = dest,
+                  action = action, seconds = round(seconds, 4))
+        stats.count(proposal, 'frames_moved')
+        stats.count(proposal, 'frames_' + action)
+        stats.sample(proposal, 'move', seconds)
+
+        if action == 'identical':
+            log.write("Skipping move of " + files + ", identical to " + dest + ".",
+                      proposal = proposal)
+            continue
+        if action == 'versioned':
+            log.write(files + " differs from the frame already in the output directory, "
+                      "moved to " + dest + ".", proposal = proposal)
+        manifest.append((dest, action, checksum))
+        if checksum is not None:
+            Write_Checksum(xlog, checksum, dest)
+
+    mpool.shutdown()
+
+    if len(manifest) > 0:
+        Write_Manifest(mpath + '/Manifest_' + proposal + '_' +
+                       datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S") + '.txt',
+                       manifest)
+
+    stats.add_time(proposal, 'move', clock.time() - stage_start)
+
+    # The run has completed, so there is nothing left to resume unless some frames
+    # could not be moved; the journal is then cut down to those frames, which the next
+    # run resumes. The newest frame of each obstype becomes the starting point of the
+    # next incremental run.
+
+    jfile.close()
+    journal = Read_Journal(jlog)
+    pending = [files for files in sorted(journal) if journal[files][0] != 'moved' and
+               os.path.exists(path1 + '/' + files)]
+
+    if len(pending) > 0:
+        with open(jlog + '.temp','w') as outfile:
+            for files in pending:
+                Write_Journal(outfile, journal[files][0], files, journal[files][1:])
+        os.rename(jlog + '.temp', jlog)
+        log.write(str(len(pending)) + " frames could not be moved, left for the next " +
+                  "run.", proposal = proposal, event = 'pending', frames = len(pending))
+    elif os.path.exists(jlog):
+        os.remove(jlog)
+
+    for items in newest:
+        if newest[items] > sync_marks.get(items, ''):
+            sync_marks[items] = newest[items]
+    Write_Sync(slog, sync_marks)
+
+    log.write("Frames moved to output directory, ready for use.", proposal = proposal)
+
+    if own_stats:
+        Write_Stats(info, stats)
+
+    if own_log:
+        log.close()
+
+    return failed
 
 
 ##################################################################################
 #
-# FUNCTION: GET_CONFIG
+# CLASS: RUN_LOG
 #
 ##################################################################################
 
-def Get_Config():
+class Run_Log(object):
     '''
-    Function to read the key parameters from the Config_GetData file to feed as
-    inputs for Get_Data function. It returns a list containing all key parameters.
+    Download log of a run, shared by all its proposals and threads. The log file is
+    opened once and written through a buffer, which is flushed at least every
+    flush_interval seconds and when the log is closed (also at exit). In the text
+    format each message is written as a line, led by the proposal in brackets when it
+    is given, so the lines of proposals processed at the same time can be told apart.
+    In the json format each message is written as a JSON object on its own line, with
+    the time, the proposal, the event and any other fields such as timings; events
+    with no message are only written in the json format. A log that grows over
+    max_size bytes is rotated to .1, .2, ... keeping up to backups old files; with 0
+    the log is started again and no old file is kept.
     '''
 
-    ConfigPath = os.path.join(os.path.expanduser('~'), '.obscontrol',
-                              'Config_GetData_Microlensing.txt')
-    
-    param = {}
-    
-    with open(ConfigPath,'r') as infile:
-        for line in infile:
-            if not line.startswith('#'):
-                if not line.startswith('\n'):
-                    col = line.split()
-                    param[col[0]] = col[1]
+    def __init__(self,filename,fmt = 'text',max_size = 0,backups = 5,
+                 flush_interval = 5.0):
+        self.filename = filename
+        self.fmt = fmt
+        self.max_size = max_size
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.outfile = None
+        self.open()
+        atexit.register(self.close)
 
-    return param
+    def open(self):
+        '''
+        Open the log file for appending and write the time of the run.
+        '''
+
+        new = not os.path.exists(self.filename)
+        self.outfile = open(self.filename,'a')
+        self.last = clock.time()
+
+        if self.fmt == 'json':
+            self.outfile.write(json.dumps({'time': time, 'event': 'run',
+                                           'pid': os.getpid()}) + "\n")
+        elif new:
+            self.outfile.write("##### GetData Download Logfile #####" + "\n" + "\n")
+            self.outfile.write(time + "\n" + "\n")
+        else:
+            self.outfile.write("\n" + "\n" + time + "\n" + "\n")
+
+    def write(self,message,**fields):
+        '''
+        Write a message with its fields to the log.
+        '''
+
+        if self.fmt == 'json':
+            record = {'time': datetime.datetime.utcnow().isoformat(),
+                      'event': fields.pop('event', 'message')}
+            record.update(fields)
+            if message is not None:
+                record['message'] = message
+            line = json.dumps(record) + "\n"
+        elif message is not None and fields.get('proposal') is not None:
+            line = "[" + fields['proposal'] + "] " + message + "\n"
+        elif message is not None:
+            line = message + "\n"
+        else:
+            return
+
+        with self.lock:
+            if self.outfile is None:
+                return
+            self.outfile.write(line)
+            if clock.time() - self.last > self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self.outfile.flush()
+        self.last = clock.time()
+
+        if self.max_size > 0 and self.outfile.tell() > self.max_size:
+            self.outfile.close()
+            for a in range(self.backups - 1, 0, -1):
+                if os.path.exists(self.filename + '.' + str(a)):
+                    os.rename(self.filename + '.' + str(a),
+                              self.filename + '.' + str(a + 1))
+            if self.backups > 0:
+                os.rename(self.filename, self.filename + '.1')
+            else:
+                os.remove(self.filename)
+            self.open()
+
+    def flush(self):
+        '''
+        Write out the buffer, rotating the log file if it has grown too large.
+        '''
+
+        with self.lock:
+            if self.outfile is not None:
+                self._flush()
+
+    def close(self):
+        '''
+        Write out the buffer and close the log file.
+        '''
+
+        with self.lock:
+            if self.outfile is not None:
+                self._flush()
+                self.outfile.close()
+                self.outfile = None
+
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
 
 
 ##################################################################################
-# COMMANDLINE RUN SECTION
-'''
-Run the above script from the Linux command line. It calls Get_Config() first, then
-Get_Data() and finally calls Output_HTML().
-'''
+#
+# FUNCTION: GET_LOG
+#
+##################################################################################
 
-if __name__ == '__main__':
-    Execute()
+def Get_Log(info):
+    '''
+    Function to open the Run_Log of the day from the configuration file. The json
+    format is written to a .jsonl file next to the text log.
+    '''
+
+    fmt = info.get('log_format', 'text')
+    dlog = info['downloadlog_directory'] + '/DownloadLog_' + time0
+    if fmt == 'json':
+        dlog = dlog + '.jsonl'
+    else:
+        dlog = dlog + '.txt'
+
+    return Run_Log(dlog, fmt, int(float(info.get('log_max_size(MB)', 0)) * 1048576),
+                   int(info.get('log_backups', 5)),
+                   float(info.get('log_flush(s)', 5.0)))
+
+
+##################################################################################
+#
+# CLASS: RUN_STATS
+#
+##################################################################################
+
+class Run_Stats(object):
+    '''
+    Performance counters of a run, shared by all its proposals and threads: counts of
+    frames and bytes, the seconds spent in each stage of Get_Data and Output_HTML, and
+    the time taken by each frame in the download, parse and move stages, from which
+    the p50 and p95 latencies are given in the summary.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = clock.time()
+        self.counters = {}
+        self.stages = {}
+        self.samples = {}
+
+    def count(self,proposal,name,n = 1):
+        '''
+        Add n to a counter of the proposal.
+        '''
+
+        with self.lock:
+            key = (proposal, name)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_time(self,proposal,stage,seconds):
+        '''
+        Add the seconds spent in a stage by the proposal.
+        '''
+
+        with self.lock:
+            key = (proposal, stage)
+            self.stages[key] = self.stages.get(key, 0.0) + seconds
+
+    def sample(self,proposal,stage,seconds):
+        '''
+        Record the seconds taken by one frame in a stage.
+        '''
+
+        with self.lock:
+            self.samples.setdefault((proposal, stage), []).append(seconds)
+
+    def summary(self):
+        '''
+        Return the counters, stage times and latencies of each proposal as a dictionary
+        ready to be written as JSON.
+        '''
+
+        with self.lock:
+            proposals = {}
+            for (proposal, name), value in self.counters.items():
+                proposals.setdefault(proposal, {'counters': {}, 'stages': {},
+                                                'latency': {}})['counters'][name] = value
+            for (proposal, stage), value in self.stages.items():
+                proposals.setdefault(proposal, {'counters': {}, 'stages': {},
+                                                'latency': {}})['stages'][stage] = \
+                    round(value, 3)
+            for (proposal, stage), values in self.samples.items():
+                p50, p95 = np.percentile(values, [50, 95])
+                proposals.setdefault(proposal, {'counters': {}, 'stages': {},
+                                                'latency': {}})['latency'][stage] = \
+                    {'count': len(values), 'p50': round(float(p50), 4),
+                     'p95': round(float(p95), 4), 'max': round(max(values), 4)}
+
+        modules = [name for name in ['numpy', 'astropy.io.fits'] if name in sys.modules]
+
+        return {'time': time, 'pid': os.getpid(),
+                'seconds': round(clock.time() - self.start, 3), 'proposals': proposals,
+                'modules': modules}
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_STATS
+#
+##################################################################################
+
+def Write_Stats(info,stats):
+    '''
+    Function to write the summary of a run to the run_summary file as JSON and, unless
+    prometheus_textfile is NONE, to a file in the Prometheus textfile exporter format.
+    Both files are written to a temporary file first and renamed, so they are never
+    read half written, and describe the latest run only.
+    '''
+
+    summary = stats.summary()
+    summary_file = info.get('run_summary', info['downloadlog_directory'] +
+                            '/GetData_summary.json')
+
+    with open(summary_file + '.tmp','w') as outfile:
+        json.dump(summary, outfile, indent = 1, sort_keys = True)
+    os.rename(summary_file + '.tmp', summary_file)
+
+    textfile = info.get('prometheus_textfile', 'NONE')
+    if textfile == 'NONE':
+        return
+
+    lines = []
+
+    lines.append("# HELP getdata_run_seconds Duration of the last GetData run.")
+    lines.append("# TYPE getdata_run_seconds gauge")
+    lines.append("getdata_run_seconds " + str(summary['seconds']))
+    lines.append("# HELP getdata_last_run_timestamp_seconds End time of the last GetData "
+                 "run.")
+    lines.append("# TYPE getdata_last_run_timestamp_seconds gauge")
+    lines.append("getdata_last_run_timestamp_seconds " + str(int(clock.time())))
+
+    counters = sorted(set(name for proposal in summary['proposals'].values()
+                          for name in proposal['counters']))
+    for name in counters:
+        lines.append("# HELP getdata_" + name + " Count of " + name.replace('_', ' ') +
+                     " in the last GetData run.")
+        lines.append("# TYPE getdata_" + name + " gauge")
+        for proposal in sorted(summary['proposals']):
+            values = summary['proposals'][proposal]['counters']
+            if name in values:
+                lines.append('getdata_' + name + '{proposal="' + proposal + '"} ' +
+                             str(values[name]))
+
+    lines.append("# HELP getdata_stage_seconds Seconds spent in each stage in the last "
+                 "GetData run.")
+    lines.append("# TYPE getdata_stage_seconds gauge")
+    for proposal in sorted(summary['proposals']):
+        stages = summary['proposals'][proposal]['stages']
+        for stage in sorted(stages):
+            lines.append('getdata_stage_seconds{proposal="' + proposal + '",stage="' +
+                         stage + '"} ' + str(stages[stage]))
+
+    lines.append("# HELP getdata_frame_seconds Per-frame latency of each stage in the "
+                 "last GetData run.")
+    lines.append("# TYPE getdata_frame_seconds gauge")
+    for proposal in sorted(summary['proposals']):
+        latency = summary['proposals'][proposal]['latency']
+        for stage in sorted(latency):
+            for quantile in ['p50', 'p95']:
+                lines.append('getdata_frame_seconds{proposal="' + proposal + '",stage="' +
+                             stage + '",quantile="0.' + quantile[1:] + '"} ' +
+                             str(latency[stage][quantile]))
+
+    with open(textfile + '.tmp','w') as outfile:
+        outfile.write("\n".join(lines) + "\n")
+    os.rename(textfile + '.tmp', textfile)
+
+
+##################################################################################
+#
+# CLASS: PROPOSAL_LOCK
+#
+##################################################################################
+
+class Proposal_Lock(object):
+    '''
+    Lock file held by the run working on one proposal. The file is locked with fcntl,
+    so the lock of a run that crashed is released by the system, and it records the
+    PID of the holder and a heartbeat which the run refreshes with touch() as it works
+    through the frames, so a run that stops making progress stops refreshing it. A
+    lock whose heartbeat is older than ttl seconds belongs to a run that hung; it is
+    reclaimed by removing the file and locking a new one.
+    '''
+
+    def __init__(self,lockfile,ttl):
+        self.lockfile = lockfile
+        self.ttl = ttl
+        self.lock = None
+        self.last = 0
+
+    def acquire(self):
+        '''
+        Take the lock and write the first heartbeat. Returns False if a live run holds
+        it.
+        '''
+
+        while True:
+            lock = open(self.lockfile,'a+')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                lock.close()
+                pid, heartbeat = self.holder()
+                if heartbeat is not None and clock.time() - heartbeat > self.ttl:
+                    try:
+                        os.remove(self.lockfile)
+                    except OSError:
+                        pass
+                    continue
+                return False
+
+            # Another run may have removed the file while this one was waiting for it;
+            # start again with the new file if so.
+
+            try:
+                same = os.fstat(lock.fileno()).st_ino == os.stat(self.lockfile).st_ino
+            except OSError:
+                same = False
+            if not same:
+                lock.close()
+                continue
+
+            self.lock = lock
+            self.beat()
+            return True
+
+    def beat(self):
+        '''
+        Write the PID of this run and the current time to the lock file.
+        '''
+
+        self.lock.seek(0)
+        self.lock.truncate()
+        self.lock.write(str(os.getpid()) + " " + repr(clock.time()) + " " + time + "\n")
+        self.lock.flush()
+        self.last = clock.time()
+
+    def touch(self):
+        '''
+        Refresh the heartbeat if a quarter of the ttl has passed since the last one.
+        Called by the run each time it makes progress.
+        '''
+
+        if self.lock is not None and clock.time() - self.last > self.ttl / 4.0:
+            self.beat()
+
+    def holder(self):
+        '''
+        Return the PID and the heartbeat written in the lock file, or None for both if
+        they cannot be read.
+        '''
+
+        try:
+            with open(self.lockfile,'r') as infile:
+                col = infile.read().split()
+            return int(col[0]), float(col[1])
+        except (IOError, OSError, IndexError, ValueError):
+            return None, None
+
+    def release(self):
+        '''
+        Remove the lock file and unlock it. The file is only removed if it is still the
+        one this run locked; a run that was taken for hung may have lost it to another.
+        '''
+
+        try:
+            if os.fstat(self.lock.fileno()).st_ino == os.stat(self.lockfile).st_ino:
+                os.remove(self.lockfile)
+        except OSError:
+            pass
+        self.lock.close()
+        self.lock = None
+
+
+##################################################################################
+#
+# FUNCTION: READ_JOURNAL
+#
+##################################################################################
+
+def Read_Journal(jlog):
+    '''
+    Function to read the checkpoint journal of a proposal and return the latest state
+    of each frame in it (listed, downloaded, parsed, logged or moved) as a dictionary
+    of lists, the state followed by the values recorded with it. The journal only
+    exists while a run is going on or after a run has died midway.
+    '''
+
+    journal = {}
+
+    if os.path.exists(jlog):
+        with open(jlog,'r') as infile:
+            for line in infile:
+                col = line.rstrip('\n').split('\t')
+                if len(col) >= 2:
+                    journal[col[1]] = [col[0]] + col[2:]
+
+    return journal
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_JOURNAL
+#
+##################################################################################
+
+def Write_Journal(outfile,state,filename,values = ()):
+    '''
+    Function to append the new state of a frame to the checkpoint journal, open as
+    outfile, with any values to remember for it (the header values of a parsed frame),
+    separated by tabs. The line is flushed so it survives the run dying.
+    '''
+
+    outfile.write('\t'.join([state, str(filename)] + [str(v) for v in values]) + "\n")
+    outfile.flush()
+
+
+##################################################################################
+#
+# FUNCTION: READ_SYNC
+#
+##################################################################################
+
+def Read_Sync(slog):
+    '''
+    Function to read the sync file of a proposal, which holds for each obstype the
+    observation date (DATE_OBS) of the newest frame already ingested, and return it as
+    a dictionary.
+    '''
+
+    sync_marks = {}
+
+    if os.path.exists(slog):
+        with open(slog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        sync_marks[col[0]] = col[1]
+
+    return sync_marks
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_SYNC
+#
+##################################################################################
+
+def Write_Sync(slog,sync_marks):
+    '''
+    Function to write the sync file of a proposal through a temporary file which is
+    then renamed over it.
+    '''
+
+    with open(slog + '.temp','w') as outfile:
+        outfile.write("# Obstype" + "     " + "Newest DATE_OBS" + "\n")
+        for items in sorted(sync_marks):
+            outfile.write(items + "     " + sync_marks[items] + "\n")
+
+    os.rename(slog + '.temp', slog)
+
+
+##################################################################################
+#
+# FUNCTION: SYNC_START
+#
+##################################################################################
+
+def Sync_Start(date_start,mark,overlap):
+    '''
+    Function to return the start of an incremental query: overlap hours before the
+    newest frame already ingested, but never before date_start from the config file.
+    '''
+
+    start = datetime.datetime.strptime(date_start, "%Y-%m-%d")
+    mark = (datetime.datetime.strptime(mark, "%Y-%m-%d" + "T" + "%H:%M:%S") -
+            datetime.timedelta(hours = overlap))
+
+    return max(start, mark).strftime("%Y-%m-%d" + "T" + "%H:%M:%S")
+
+
+##################################################################################
+#
+# FUNCTION: READ_CATALOG
+#
+##################################################################################
+
+def Read_Catalog(clog):
+    '''
+    Function to read the Catalog log file once and return the set of file names that
+    have already been downloaded, so that each frame returned by the archive can be
+    checked against it without scanning the file again.
+    '''
+
+    catalog_files = set()
+
+    if os.path.exists(clog):
+        with open(clog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        catalog_files.add(col[0])
+
+    return catalog_files
+
+
+##################################################################################
+#
+# FUNCTION: READ_TIMELOG
+#
+##################################################################################
+
+def Read_TimeLog(tlog):
+    '''
+    Function to read the TimeLog file once and return two sets: the file names whose
+    time has already been calculated, and the group names that already have at least
+    one frame in the log.
+    '''
+
+    timelog_files = set()
+    timelog_groups = set()
+
+    if os.path.exists(tlog):
+        with open(tlog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        timelog_groups.add(col[0])
+                        timelog_files.add(col[1])
+
+    return timelog_files, timelog_groups
+
+
+##################################################################################
+#
+# FUNCTION: CACHED_INDEX
+#
+##################################################################################
+
+def Cached_Index(filename,reader):
+    '''
+    Function to return reader(filename), reusing the result of the last call for the
+    same file if the file has not changed since (same inode, size and modification
+    time). Get_Data only adds to the indexes what it has appended to the file, so an
+    index is never ahead of the file it was read from.
+    '''
+
+    try:
+        stat = os.stat(filename)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime)
+    except OSError:
+        key = None
+
+    cached = index_cache.get(filename)
+    if key is not None and cached is not None and cached[0] == key:
+        return cached[1]
+
+    result = reader(filename)
+    index_cache[filename] = (key, result)
+
+    return result
+
+
+##################################################################################
+#
+# FUNCTION: HEADER_END
+#
+##################################################################################
+
+def Header_End(data):
+    '''
+    Function to look for the END card of the first FITS header in the given bytes. The
+    header is made of 2880-byte blocks of 80-character cards; the function returns the
+    length of the header up to the end of the block holding the END card, or None if
+    the END card is not in the complete blocks given.
+    '''
+
+    for block in range(0, len(data) - 2879, 2880):
+        for card in range(block, block + 2880, 80):
+            if data[card:card + 8] == b'END     ':
+                return block + 2880
+
+    return None
+
+
+##################################################################################
+#
+# FUNCTION: READ_HEADER
+#
+##################################################################################
+
+def Read_Header(filename,blocks = None):
+    '''
+    Function to read the primary header of a frame without opening the frame with
+    fits.open, so no HDU is built and nothing is decompressed. Only the header blocks
+    at the start of the file are read, and the file is closed before returning. If
+    the header blocks were already kept from the download stream, they are used and
+    the file is not read at all.
+    '''
+
+    if blocks is None:
+        data = b''
+        with open(filename,'rb') as infile:
+            while Header_End(data) is None:
+                block = infile.read(2880)
+                if len(block) < 2880:
+                    raise IOError("No END card in the primary header of " + filename)
+                data = data + block
+        blocks = data
+
+    return fits.Header.fromstring(blocks.decode('ascii'))
+
+
+##################################################################################
+#
+# FUNCTION: READ_OVERHEADS
+#
+##################################################################################
+
+def Read_Overheads(info):
+    '''
+    Function to read the overhead table from the configuration file. Each entry
+    overhead(xx)(s) gives, for instruments whose name starts with xx, the setup time
+    added to the first frame of a group (slew to the target) followed by the
+    pre-exposure, readout and post-exposure overheads of every frame, in seconds.
+    An entry overhead(xx,ap)(s) applies only to those instruments on telescopes of
+    aperture ap (e.g. 1m0) and is keyed by the pair; it takes precedence over the
+    entry for xx. Instruments without an entry use the values this script has always
+    used.
+    '''
+
+    overheads = {'fl': [90.0, 2.0, 37.0, 1.0],
+                 'kb': [90.0, 2.0, 14.5, 1.0],
+                 'fs': [240.0, 2.0, 10.5, 12.0]}
+
+    for key in info:
+        match = re.match(r'overhead\((\w+)(?:,(\w+))?\)\(s\)$', key)
+        if match and match.group(2) is None:
+            overheads[match.group(1)] = [float(t) for t in info[key].split(',')]
+        elif match:
+            overheads[match.groups()] = [float(t) for t in info[key].split(',')]
+
+    return overheads
+
+
+##################################################################################
+#
+# FUNCTION: FRAME_HEADER
+#
+##################################################################################
+
+def Frame_Header(filename,blocks = None):
+    '''
+    Function to read the header of one frame and return the group name, exposure time,
+    instrument name and telescope ID needed for the time calculation. It is run by the
+    worker processes in Get_Data.
+    '''
+
+    header = Read_Header(filename, blocks)
+
+    return (header['GROUPID'], float(header['EXPTIME']), header['INSTRUME'],
+            header['TELID'])
+
+
+##################################################################################
+#
+# FUNCTION: PROCESS_POOL
+#
+##################################################################################
+
+def Process_Pool(max_workers):
+    '''
+    Function to start the pool of worker processes that read frame headers. Several
+    proposals are processed by threads of the same run, and a process forked while
+    another thread holds a lock can hang on it, so the workers are started from a
+    forkserver where the Python version and the system allow it.
+    '''
+
+    try:
+        context = multiprocessing.get_context('forkserver')
+        return ProcessPoolExecutor(max_workers = max_workers, mp_context = context)
+    except (AttributeError, TypeError, ValueError):
+        return ProcessPoolExecutor(max_workers = max_workers)
+
+
+##################################################################################
+#
+# FUNCTION: TIMED_HEADER
+#
+##################################################################################
+
+def Timed_Header(filename,blocks = None):
+    '''
+    Function to run Frame_Header and return its result with the time it took in
+    seconds, for the download log. A frame whose header is missing a keyword or cannot
+    be read gets unknown_header, so one bad frame does not stop the worker pool.
+    '''
+
+    start = clock.time()
+    try:
+        frame_header = Frame_Header(filename, blocks)
+    except (KeyError, ValueError, IOError, OSError):
+        frame_header = unknown_header
+
+    return frame_header, clock.time() - start
+
+
+##################################################################################
+#
+# FUNCTION: FRAME_TIMES
+#
+##################################################################################
+
+def Frame_Times(frame_headers,timelog_groups,overheads):
+    '''
+    Function to calculate the time used to obtain each frame from the values returned
+    by Frame_Header, as a NumPy array in the same order. Each time is the exposure time
+    plus the overheads of its instrument (and aperture, where the overhead table has an
+    entry for the pair) from the overhead table, plus the setup time
+    if the frame is the first one of its group: the group is not in timelog_groups and
+    no earlier frame of the group in frame_headers is written to the log. Frames of an
+    unknown class of instrument get NaN.
+    '''
+
+    if len(frame_headers) == 0:
+        return np.zeros(0)
+
+    groups = np.array([str(frame_header[0]) for frame_header in frame_headers])
+    exptime = np.array([frame_header[1] for frame_header in frame_headers])
+    prefix = [frame_header[2][0:2] for frame_header in frame_headers]
+    aperture = np.array([frame_header[3][0:3] for frame_header in frame_headers])
+
+    table = np.array([overheads.get((p, a), overheads.get(p, [np.nan] * 4))
+                      for p, a in zip(prefix, aperture)], dtype = float)
+    known = ~np.isnan(table[:,0])
+
+    # Only frames that are written to the log make their group known, so the first
+    # frame of each group is looked for among the frames with a known instrument and
+    # aperture.
+
+    logged = known & np.isin(aperture, ['2m0','1m0','0m8','0m4'])
+    first = np.zeros(len(frame_headers), dtype = bool)
+    index = np.flatnonzero(logged)
+    if len(index) > 0:
+        names, order = np.unique(groups[index], return_index = True)
+        new_group = ~np.isin(names, list(timelog_groups))
+        first[index[order[new_group]]] = True
+
+    # The times are added up in the same order as the overheads are listed in the
+    # table, with the setup time first.
+
+    obstime = exptime + np.where(first, table[:,0], 0.0)
+    for column in range(1, table.shape[1]):
+        obstime = obstime + table[:,column]
+
+    obstime[~known] = np.nan
+
+    return obstime
+
+
+##################################################################################
+#
+# FUNCTION: SUM_TIMES
+#
+##################################################################################
+
+def Sum_Times(keys,times,mask = None):
+    '''
+    Function to add up times by key (aperture or group name) in a single pass with
+    NumPy and return a dictionary of totals. Only times where mask is True are used.
+    '''
+
+    keys = np.array(keys, dtype = str)
+    times = np.asarray(times, dtype = float)
+
+    if mask is not None:
+        keys = keys[mask]
+        times = times[mask]
+
+    if len(keys) == 0:
+        return {}
+
+    names, inverse = np.unique(keys, return_inverse = True)
+    totals = np.bincount(inverse.ravel(), weights = times, minlength = len(names))
+
+    return dict(zip(names.tolist(), totals.tolist()))
+
+
+##################################################################################
+#
+# FUNCTION: SUM_TIMELOG
+#
+##################################################################################
+
+def Sum_TimeLog(tlog,tsum):
+    '''
+    Function to return the time in seconds used in the TimeLog file broken down by
+    aperture, night, site, instrument and group, as from Add_Breakdowns. The
+    breakdowns are kept in the TimeSum file together with the number of bytes of the
+    TimeLog already added up, its inode and a checksum of the start and the end of
+    those bytes, so only the rows appended since then are read and added. If the
+    TimeLog has been replaced, shortened or changed (e.g. by Compact_TimeLog), all of
+    it is added up again.
+    '''
+
+    marks, breakdowns = Read_TimeSum(tsum)
+    offset = int(marks.get('offset', 0))
+
+    with open(tlog,'rb') as infile:
+        stat = os.fstat(infile.fileno())
+        if (str(stat.st_ino) != marks.get('inode') or stat.st_size < offset or
+            Offset_Checksum(infile, offset) != marks.get('checksum')):
+            breakdowns = {}
+            offset = 0
+
+        infile.seek(offset)
+        data = infile.read()
+
+    # Only complete rows are added; a row still being written is left for next time.
+
+    data = data[:data.rfind(b'\n') + 1]
+
+    groups = []
+    filenames = []
+    apertures = []
+    times = []
+    for line in data.decode().splitlines(True):
+        if not line.startswith('#'):
+            if not line.startswith('\n'):
+                col = line.split()
+
+        # Rows that are not a frame of a known aperture with its time (e.g. a group
+        # name with a space in it) are left out, as they always have been.
+
+                if len(col) != 4 or col[2] not in ['2m0','1m0','0m8','0m4']:
+                    continue
+                try:
+                    float(col[3])
+                except ValueError:
+                    continue
+                groups.append(col[0])
+                filenames.append(col[1])
+                apertures.append(col[2])
+                times.append(col[3])
+
+    Add_Breakdowns(breakdowns, groups, filenames, apertures, times)
+
+    offset = offset + len(data)
+
+    with open(tlog,'rb') as infile:
+        checksum = Offset_Checksum(infile, offset)
+
+    Write_TimeSum(tsum, [('offset', offset), ('inode', stat.st_ino),
+                         ('checksum', checksum)], breakdowns)
+
+    return breakdowns
+
+
+##################################################################################
+#
+# FUNCTION: READ_TIMESUM
+#
+##################################################################################
+
+def Read_TimeSum(tsum):
+    '''
+    Function to read the TimeSum file, which holds the breakdowns of the time used and
+    marks of how much of the accounting data they include, separated by tabs since
+    group names may contain spaces. Returns the marks as a dictionary of strings and
+    the breakdowns as in Add_Breakdowns. A file that cannot be read is treated as
+    missing, so everything is added up again.
+    '''
+
+    marks = {}
+    breakdowns = {}
+
+    if os.path.exists(tsum):
+        try:
+            with open(tsum,'r') as infile:
+                for line in infile:
+                    if not line.startswith('#'):
+                        if not line.startswith('\n'):
+                            col = line.rstrip('\n').split('\t')
+                            if len(col) == 2:
+                                marks[col[0]] = col[1]
+                            elif len(col) == 3:
+                                breakdowns.setdefault(col[0], {})[col[1]] = float(col[2])
+                            else:
+                                raise ValueError("bad row in " + tsum)
+        except (IOError, OSError, ValueError, UnicodeDecodeError):
+            return {}, {}
+
+    return marks, breakdowns
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_TIMESUM
+#
+##################################################################################
+
+def Write_TimeSum(tsum,marks,breakdowns):
+    '''
+    Function to write the marks, a list of (name, value) pairs, and the breakdowns to
+    the TimeSum file, one tab separated row each, through a temporary file which is
+    renamed over it.
+    '''
+
+    with open(tsum + '.tmp','w') as outfile:
+        outfile.write("##### GetData Time Summary File #####" + "\n" + "\n")
+        for name, value in marks:
+            outfile.write(name + "\t" + str(value) + "\n")
+        for dimension in sorted(breakdowns):
+            for key in sorted(breakdowns[dimension]):
+                outfile.write(dimension + "\t" + key + "\t" +
+                              repr(breakdowns[dimension][key]) + "\n")
+    os.rename(tsum + '.tmp', tsum)
+
+
+##################################################################################
+#
+# FUNCTION: ADD_BREAKDOWNS
+#
+##################################################################################
+
+def Add_Breakdowns(breakdowns,groups,filenames,apertures,times):
+    '''
+    Function to add the times of a list of frames to the breakdowns, a dictionary of
+    totals in seconds by dimension and key: aperture, night (the date in the frame
+    name), site, instrument (the first two letters of the instrument name, as in the
+    overhead table), group, and aperture_night (aperture:night, for the burn rate).
+    Each dimension is added up with Sum_Times in one pass.
+    '''
+
+    nights = [Frame_Key(filename, 'night') for filename in filenames]
+    sites = [Frame_Key(filename, 'site') for filename in filenames]
+    instruments = [Frame_Key(filename, 'instrument') for filename in filenames]
+
+    keys = {'aperture': apertures, 'night': nights, 'site': sites,
+            'instrument': instruments, 'group': groups,
+            'aperture_night': [aperture + ':' + night for aperture, night
+                               in zip(apertures, nights)]}
+
+    for dimension in keys:
+        totals = breakdowns.setdefault(dimension, {})
+        for key, total in Sum_Times(keys[dimension], times).items():
+            totals[key] = totals.get(key, 0.0) + total
+
+    return breakdowns
+
+
+##################################################################################
+#
+# FUNCTION: FRAME_KEY
+#
+##################################################################################
+
+def Frame_Key(filename,dimension):
+    '''
+    Function to return the night (the date in the frame name), the site or the
+    instrument (the first two letters of the instrument name) of a frame from its
+    file name, or 'unknown' if the name does not have these parts.
+    '''
+
+    parts = filename.split('-')
+    if len(parts) <= 2:
+        return 'unknown'
+
+    return {'site': parts[0][0:3], 'instrument': parts[1][0:2],
+            'night': parts[2]}[dimension]
+
+
+##################################################################################
+#
+# FUNCTION: OFFSET_CHECKSUM
+#
+##################################################################################
+
+def Offset_Checksum(infile,offset,size = 4096):
+    '''
+    Function to return the MD5 checksum of the first and the last size bytes before
+    offset in an open file, which tells if the part of a file already read has been
+    changed without reading all of it again.
+    '''
+
+    md5 = hashlib.md5()
+
+    infile.seek(0)
+    md5.update(infile.read(min(size, offset)))
+    infile.seek(max(0, offset - size))
+    md5.update(infile.read(offset - max(0, offset - size)))
+
+    return md5.hexdigest()
+
+
+##################################################################################
+#
+# FUNCTION: COMPACT_TIMELOG
+#
+##################################################################################
+
+def Compact_TimeLog(tlog):
+    '''
+    Function to rewrite an append-only TimeLog file so that the frames of each group
+    are listed together again. Groups keep the order in which they first appear in the
+    file and frames keep their order within a group. The sorted log is written to a
+    temporary file next to the TimeLog and then renamed over it.
+    '''
+
+    header = []
+    groups = []
+    rows = {}
+
+    with open(tlog,'r') as infile:
+        for line in infile:
+            if line.startswith('#') or line.startswith('\n'):
+                if len(groups) == 0:
+                    header.append(line)
+            else:
+                group = line.split()[0]
+                if group not in rows:
+                    groups.append(group)
+                    rows[group] = []
+                rows[group].append(line)
+
+    temp = tlog + '.temp'
+
+    with open(temp,'w') as outfile:
+        outfile.writelines(header)
+        for group in groups:
+            outfile.writelines(rows[group])
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.rename(temp, tlog)
+
+
+##################################################################################
+#
+# FUNCTION: OPEN_TIMEDB
+#
+##################################################################################
+
+def Open_TimeDB(tdb):
+    '''
+    Function to open the SQLite TimeLog database, creating its tables if they do not
+    exist yet. The frames table holds the same columns as the TimeLog file, indexed
+    by group and by aperture; the groups table holds the first frame of each group and
+    the meta table records when the TimeLog file was imported.
+    '''
+
+    conn = sqlite3.connect(tdb)
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS groups ("
+                     "groupid TEXT PRIMARY KEY, first_frame TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS frames ("
+                     "filename TEXT PRIMARY KEY, groupid TEXT NOT NULL, "
+                     "aperture TEXT NOT NULL, obstime REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS frames_groupid ON frames (groupid)")
+        conn.execute("CREATE INDEX IF NOT EXISTS frames_aperture ON frames (aperture)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta ("
+                     "key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    return conn
+
+
+##################################################################################
+#
+# FUNCTION: INSERT_TIMEDB
+#
+##################################################################################
+
+def Insert_TimeDB(conn,group,filename,aperture,obstime):
+    '''
+    Function to insert the time calculated for one frame into the TimeLog database,
+    together with its group if this is the first frame of the group.
+    '''
+
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO groups (groupid, first_frame) VALUES (?, ?)",
+                     (str(group), str(filename)))
+        conn.execute("INSERT OR IGNORE INTO frames (filename, groupid, aperture, obstime) "
+                     "VALUES (?, ?, ?, ?)",
+                     (str(filename), str(group), aperture, float(obstime)))
+
+
+##################################################################################
+#
+# FUNCTION: IMPORT_TIMELOG
+#
+##################################################################################
+
+def Import_TimeLog(conn,tlog):
+    '''
+    Function to import the TimeLog file of a proposal, if there is one, into the
+    TimeLog database. The frames are inserted and the import is recorded in the meta
+    table in one transaction, so an import that fails is tried again by the next run.
+    '''
+
+    frames = []
+
+    if os.path.exists(tlog):
+        with open(tlog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        frames.append((col[1], col[0], col[2], float(col[3])))
+
+    with conn:
+        for filename, group, aperture, obstime in frames:
+            conn.execute("INSERT OR IGNORE INTO groups (groupid, first_frame) "
+                         "VALUES (?, ?)", (group, filename))
+        conn.executemany("INSERT OR IGNORE INTO frames (filename, groupid, aperture, "
+                         "obstime) VALUES (?, ?, ?, ?)", frames)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)",
+                     (time,))
+
+
+##################################################################################
+#
+# FUNCTION: READ_TIMEDB
+#
+##################################################################################
+
+def Read_TimeDB(conn):
+    '''
+    Function to return the same two sets as Read_TimeLog, the file names and the group
+    names already in the log, read from the TimeLog database instead.
+    '''
+
+    timelog_files = set(row[0] for row in conn.execute("SELECT filename FROM frames"))
+    timelog_groups = set(row[0] for row in conn.execute("SELECT groupid FROM groups"))
+
+    return timelog_files, timelog_groups
+
+
+##################################################################################
+#
+# FUNCTION: SUM_TIMEDB
+#
+##################################################################################
+
+def Sum_TimeDB(conn):
+    '''
+    Function to return the same breakdowns of the time used as Sum_TimeLog, added up
+    by the TimeLog database with one SUM query per dimension. The aperture and group
+    totals are grouped on the indexed columns; the night, site and instrument are
+    taken from the frame name with Frame_Key.
+    '''
+
+    conn.create_function('frame_key', 2, Frame_Key)
+
+    columns = {'aperture': "aperture",
+               'group': "groupid",
+               'night': "frame_key(filename, 'night')",
+               'site': "frame_key(filename, 'site')",
+               'instrument': "frame_key(filename, 'instrument')",
+               'aperture_night': "aperture || ':' || frame_key(filename, 'night')"}
+
+    breakdowns = {}
+
+    for dimension in columns:
+        breakdowns[dimension] = dict(conn.execute("SELECT " + columns[dimension] +
+                                                  ", SUM(obstime) FROM frames GROUP BY " +
+                                                  columns[dimension]).fetchall())
+
+    return breakdowns
+
+
+##################################################################################
+#
+# FUNCTION: BURN_RATE
+#
+##################################################################################
+
+def Burn_Rate(breakdowns,allocations,window):
+    '''
+    Function to project the use of the allocation of each aperture from the
+    breakdowns. The burn rate is the mean time used per night over the last window
+    nights up to the newest night in the log; at that rate, the nights left and the
+    night the allocation runs out are projected. Returns a dictionary by aperture of
+    hours used, hours allocated, burn rate in hours per night, nights left and the
+    projected date (None if nothing was used in the window). Apertures with no
+    allocation (NONE) are left out.
+    '''
+
+    nights = sorted(night for night in breakdowns.get('night', {}) if night.isdigit())
+    if len(nights) == 0:
+        return {}
+
+    last = datetime.datetime.strptime(nights[-1], '%Y%m%d')
+    first = (last - datetime.timedelta(days = window - 1)).strftime('%Y%m%d')
+
+    burn = {}
+
+    for aperture in ['1m0','2m0','0m8','0m4']:
+        if allocations[aperture] == 'NONE':
+            continue
+
+        used = breakdowns.get('aperture', {}).get(aperture, 0.0) / 3600.0
+        recent = 0.0
+        for key, total in breakdowns.get('aperture_night', {}).items():
+            key_aperture, night = key.split(':')
+            if key_aperture == aperture and night.isdigit() and night >= first:
+                recent = recent + total / 3600.0
+
+        rate = recent / window
+        left = float(allocations[aperture]) - used
+        burn[aperture] = {'used_hrs': round(used, 2),
+                          'allocated_hrs': float(allocations[aperture]),
+                          'rate_hrs_per_night': round(rate, 3),
+                          'nights_left': None, 'exhausted': None}
+        if rate > 0:
+            burn[aperture]['nights_left'] = round(max(left, 0.0) / rate, 1)
+            try:
+                burn[aperture]['exhausted'] = (last + datetime.timedelta(days =
+                                               max(left, 0.0) / rate)).strftime('%Y-%m-%d')
+            except OverflowError:
+                pass
+
+    return burn
+
+
+##################################################################################
+#
+# FUNCTION: REPORT_TABLES
+#
+##################################################################################
+
+def Report_Tables(breakdowns,burn,window):
+    '''
+    Function to render the burn rate projection and the time used per night, site,
+    instrument and group as HTML tables for the time report.
+    '''
+
+    html = "<h3>Burn rate (last " + str(window) + " nights)</h3><table border=1>"
+    html = html + ("<tr><th>Aperture</th><th>Used (hrs)</th><th>Allocated (hrs)</th>"
+                   "<th>Rate (hrs/night)</th><th>Nights left</th><th>Runs out</th></tr>")
+    for aperture in ['1m0','2m0','0m8','0m4']:
+        if aperture in burn:
+            row = burn[aperture]
+            html = html + ("<tr><td>%s</td><td>%.2f</td><td>%.2f</td><td>%.3f</td>"
+                           "<td>%s</td><td>%s</td></tr>" %
+                           (aperture, row['used_hrs'], row['allocated_hrs'],
+                            row['rate_hrs_per_night'],
+                            '-' if row['nights_left'] is None else row['nights_left'],
+                            '-' if row['exhausted'] is None else row['exhausted']))
+    html = html + "</table>"
+
+    for dimension, title in [('night', 'Night'), ('site', 'Site'),
+                             ('instrument', 'Instrument'), ('group', 'Group')]:
+        totals = breakdowns.get(dimension, {})
+        html = html + ("<h3>Time used per " + title.lower() + "</h3><table border=1>"
+                       "<tr><th>" + title + "</th><th>Hours</th></tr>")
+        for key in sorted(totals):
+            html = html + ("<tr><td>%s</td><td>%.2f</td></tr>" %
+                           (escape(str(key)), totals[key] / 3600.0))
+        html = html + "</table>"
+
+    return html
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_REPORT
+#
+##################################################################################
+
+def Write_Report(prefix,proposal,breakdowns,burn):
+    '''
+    Function to export the breakdowns and the burn rate projection of a proposal to
+    prefix.json and the breakdowns to prefix.csv, one row per dimension and key. The
+    files are written to temporary files and renamed, so the dashboard never reads
+    them half written.
+    '''
+
+    hours = {}
+    for dimension in breakdowns:
+        hours[dimension] = {}
+        for key, total in breakdowns[dimension].items():
+            hours[dimension][key] = round(total / 3600.0, 4)
+
+    report = {'proposal': proposal, 'time': time, 'burn': burn, 'hours': hours}
+
+    with open(prefix + '.json.tmp','w') as outfile:
+        json.dump(report, outfile, indent = 1, sort_keys = True)
+    os.rename(prefix + '.json.tmp', prefix + '.json')
+
+    with open(prefix + '.csv.tmp','w') as outfile:
+        writer = csv.writer(outfile, lineterminator = "\n")
+        writer.writerow(['dimension', 'key', 'seconds', 'hours'])
+        for dimension in sorted(breakdowns):
+            for key in sorted(breakdowns[dimension]):
+                writer.writerow([dimension, key, repr(breakdowns[dimension][key]),
+                                 str(round(breakdowns[dimension][key] / 3600.0, 4))])
+    os.rename(prefix + '.csv.tmp', prefix + '.csv')
+
+
+##################################################################################
+#
+# CLASS: ARCHIVE_SESSION
+#
+##################################################################################
+
+class Archive_Session(requests.Session):
+    '''
+    HTTP session used for all the traffic with the archive and the frame URLs. Its
+    connection pool keeps up to pool_size connections alive for reuse, every request
+    gets a timeout of timeout seconds unless it sets its own, and a request that fails
+    with a 5xx response, a connection error or a timeout is retried up to retries
+    times, waiting a random time of up to backoff * 2**attempt seconds in between.
+    The optional request_rate and bandwidth Token_Buckets limit the number of requests
+    per second and the bytes per second read from the downloads.
+    '''
+
+    def __init__(self,pool_size = 10,retries = 3,backoff = 1.0,timeout = 60.0,
+                 request_rate = None,bandwidth = None):
+        requests.Session.__init__(self)
+        adapter = requests.adapters.HTTPAdapter(pool_connections = pool_size,
+                                                pool_maxsize = pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.request_rate = request_rate
+        self.bandwidth = bandwidth
+
+    def backoff_wait(self,attempt):
+        '''
+        Wait before the given retry, exponentially longer for each attempt and with
+        full jitter so that many failed requests are not retried all at once.
+        '''
+
+        clock.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def request(self,method,url,**kwargs):
+        '''
+        Make a request like requests.Session, with the timeout, the retries and the
+        request rate limit.
+        '''
+
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+
+        while True:
+            if self.request_rate is not None:
+                self.request_rate.consume(1)
+            try:
+                response = requests.Session.request(self, method, url, **kwargs)
+                if response.status_code < 500 or attempt >= self.retries:
+                    return response
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retries:
+                    raise
+            self.backoff_wait(attempt)
+            attempt = attempt + 1
+
+
+##################################################################################
+#
+# FUNCTION: GET_SESSION
+#
+##################################################################################
+
+def Get_Session(info):
+    '''
+    Function to make the Archive_Session for a run from the configuration file. The
+    pool holds by default one connection for each download that can run at the same
+    time over all proposals. The request rate and bandwidth limits are shared by all
+    proposals, as they share the network link.
+    '''
+
+    workers = int(info.get('max_workers', 4)) * int(info.get('proposal_workers', 1))
+    request_rate = Token_Bucket(Read_Windows(info.get('request_rate(/s)', '0')))
+    bandwidth = Token_Bucket(Read_Windows(info.get('bandwidth(kB/s)', '0'), 1024.0))
+
+    return Archive_Session(pool_size = int(info.get('http_pool_size', workers)),
+                           retries = int(info.get('http_retries', 3)),
+                           backoff = float(info.get('http_backoff(s)', 1.0)),
+                           timeout = float(info.get('http_timeout(s)', 60.0)),
+                           request_rate = request_rate, bandwidth = bandwidth)
+
+
+##################################################################################
+#
+# FUNCTION: READ_WINDOWS
+#
+##################################################################################
+
+def Read_Windows(value,scale = 1.0):
+    '''
+    Function to read a rate limit from the config file. The limit is either a single
+    rate for the whole day, or a comma separated list of time windows in local hours
+    with a rate for each, e.g. 08-20:2048,20-08:0; a window may wrap past midnight.
+    A rate of 0 means no limit. Returns a list of (start hour, end hour, rate) with the
+    rates multiplied by scale.
+    '''
+
+    windows = []
+
+    for window in value.split(','):
+        if ':' in window:
+            hours, rate = window.split(':')
+            start, end = hours.split('-')
+            windows.append((float(start), float(end), float(rate) * scale))
+        else:
+            windows.append((0.0, 24.0, float(window) * scale))
+
+    return windows
+
+
+##################################################################################
+#
+# FUNCTION: WINDOW_VALUE
+#
+##################################################################################
+
+def Window_Value(windows):
+    '''
+    Function to return the value of the time window from Read_Windows that the current
+    local time is in, or 0 if it is in none of them.
+    '''
+
+    now = clock.localtime()
+    hour = now.tm_hour + now.tm_min / 60.0
+
+    for start, end, value in windows:
+        if start <= end and start <= hour < end:
+            return value
+        if start > end and (hour >= start or hour < end):
+            return value
+
+    return 0.0
+
+
+##################################################################################
+#
+# CLASS: TOKEN_BUCKET
+#
+##################################################################################
+
+class Token_Bucket(object):
+    '''
+    Token bucket shared by the worker threads to limit a rate, in units (requests or
+    bytes) per second. The rate is looked up in the time windows from Read_Windows on
+    every use, so a long run follows the windows; a rate of 0, or no window for the
+    current hour, means no limit. Up to one second of unused rate can be saved up for
+    a burst. A thread taking more units than the bucket holds goes into debt and
+    sleeps until it is paid off, so that threads waiting together share the rate.
+    '''
+
+    def __init__(self,windows):
+        self.windows = windows
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last = clock.time()
+
+    def rate(self):
+        '''
+        Return the rate of the time window the current local time is in.
+        '''
+
+        return Window_Value(self.windows)
+
+    def consume(self,units):
+        '''
+        Take the given number of units from the bucket, waiting if needed.
+        '''
+
+        rate = self.rate()
+        if rate <= 0:
+            return
+
+        with self.lock:
+            now = clock.time()
+            self.tokens = min(rate, self.tokens + (now - self.last) * rate)
+            self.last = now
+            self.tokens = self.tokens - units
+            wait = -self.tokens / rate
+
+        if wait > 0:
+            clock.sleep(wait)
+
+
+##################################################################################
+#
+# FUNCTION: ARCHIVE_LOGIN
+#
+##################################################################################
+
+def Archive_Login(info,session):
+    '''
+    Function to log in to the archive with the username and password from the config
+    file and return the token to send with authenticated requests.
+    '''
+
+    response = session.post(info['archive'] + info['api_token'], data =
+                            {'username': info['username'],'password': info['password']})
+    response.raise_for_status()
+
+    return response.json().get('token')
+
+
+##################################################################################
+#
+# CLASS: ARCHIVE_TOKEN
+#
+##################################################################################
+
+class Archive_Token(requests.auth.AuthBase):
+    '''
+    Authentication for archive requests with a token that is cached on disk, in the
+    file token_cache (readable by the owner only), and reused by later runs until it
+    is older than token_ttl(hrs). A request that the archive refuses with 401 gets a
+    new token from Archive_Login and is sent once more, so an expired or revoked
+    token is replaced without the caller noticing.
+    '''
+
+    def __init__(self,info,session):
+        self.info = info
+        self.session = session
+        self.cache = info.get('token_cache', os.path.join(os.path.expanduser('~'),
+                                                          '.obscontrol', 'ArchiveToken.txt'))
+        self.ttl = float(info.get('token_ttl(hrs)', 24)) * 3600.0
+        self.lock = threading.Lock()
+        self.token = self.read_cache()
+        if self.token is None:
+            self.refresh(None)
+
+    def read_cache(self):
+        '''
+        Return the cached token if it belongs to the configured user and archive and
+        has not expired, otherwise None.
+        '''
+
+        try:
+            with open(self.cache,'r') as infile:
+                col = infile.read().split()
+            token, saved, username, archive = col[0], float(col[1]), col[2], col[3]
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+        if username != self.info['username'] or archive != self.info['archive']:
+            return None
+        if clock.time() - saved > self.ttl:
+            return None
+
+        return token
+
+    def write_cache(self):
+        '''
+        Write the token to the cache through a temporary file created with owner-only
+        permissions, then rename it into place.
+        '''
+
+        temp = self.cache + '.' + str(os.getpid())
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd,'w') as outfile:
+            outfile.write(self.token + " " + repr(clock.time()) + " " +
+                          self.info['username'] + " " + self.info['archive'] + "\n")
+        os.chmod(temp, 0o600)
+        os.rename(temp, self.cache)
+
+    def refresh(self,refused):
+        '''
+        Log in again and cache the new token, unless another thread has already
+        replaced the refused token in the meantime.
+        '''
+
+        with self.lock:
+            if refused is not None and self.token != refused:
+                return
+            self.token = Archive_Login(self.info, self.session)
+            self.write_cache()
+
+    def handle_401(self,response,**kwargs):
+        '''
+        Response hook sending a request refused with 401 once more with a new token.
+        '''
+
+        if response.status_code != 401 or getattr(response.request, 'token_retry', False):
+            return response
+
+        refused = response.request.headers['Authorization'][len('Token '):]
+        self.refresh(refused)
+        response.content
+        response.close()
+
+        request = response.request.copy()
+        request.headers['Authorization'] = 'Token ' + self.token
+        request.token_retry = True
+        retry = response.connection.send(request, **kwargs)
+        retry.history.append(response)
+        retry.request = request
+
+        return retry
+
+    def __call__(self,request):
+        request.headers['Authorization'] = 'Token ' + self.token
+        request.register_hook('response', self.handle_401)
+        return request
+
+
+##################################################################################
+#
+# FUNCTION: FRAME_QUERY
+#
+##################################################################################
+
+def Frame_Query(info,start,rlevel,proposal,obstype,limit = None):
+    '''
+    Function to build the URL of an archive query for the frames of one proposal and
+    obstype. Besides the dates, reduction level and page size, the optional filters of
+    the config file (site, telescope, instrument and basename) and the list of fields
+    to return are passed on to the archive, so that only the frames that are wanted
+    are sent back; filters set to NONE are left out. The fields used by this script
+    are added to the list of fields if they are not in it. If limit is given, it is
+    used as the page size and the newest frames are returned first.
+    '''
+
+    params = [('start', start),
+              ('end', info['date_end']),
+              ('RLEVEL', rlevel),
+              ('PROPID', proposal),
+              ('OBSTYPE', obstype)]
+
+    if limit is None:
+        params.append(('limit', info.get('page_size', '100')))
+    else:
+        params.append(('limit', limit))
+        params.append(('ordering', '-DATE_OBS'))
+
+    for key, param in [('site', 'SITEID'), ('telescope', 'TELID'),
+                       ('instrument', 'INSTRUME'), ('basename', 'basename')]:
+        if info.get(key, 'NONE') != 'NONE':
+            params.append((param, info[key]))
+
+    if info.get('fields', 'NONE') != 'NONE':
+        fields = [field for field in info['fields'].split(',') if field != '']
+        for field in ['filename', 'url', 'DATE_OBS', 'REQNUM', 'version_set']:
+            if field not in fields:
+                fields.append(field)
+        params.append(('fields', ','.join(fields)))
+
+    return info['archive'] + info['api_frames'] + '?' + urlencode(params)
+
+
+##################################################################################
+#
+# FUNCTION: ARCHIVE_MARKERS
+#
+##################################################################################
+
+def Archive_Markers(info,session,auth,proposal):
+    '''
+    Function to ask the archive for the number of frames of each obstype of a proposal
+    and the DATE_OBS of the newest one, with one query of a single frame per obstype.
+    Returns a dictionary of obstype to (count, newest DATE_OBS) as strings.
+    '''
+
+    rlevel = {'raw': '00', 'quicklook': '11', 'reduced': '91'}.get(info['rlevel'],
+                                                                  info['rlevel'])
+    markers = {}
+
+    for items in info['obstype'].split(','):
+        response = session.get(Frame_Query(info, info['date_start'], rlevel, proposal,
+                                           items, 1), auth = auth)
+        response.raise_for_status()
+        page = response.json()
+        newest = '-'
+        if len(page['results']) > 0 and page['results'][0].get('DATE_OBS'):
+            newest = page['results'][0]['DATE_OBS'][0:19]
+        markers[items] = (str(page.get('count', len(page['results']))), newest)
+
+    return markers
+
+
+##################################################################################
+#
+# FUNCTION: READ_MARKERS
+#
+##################################################################################
+
+def Read_Markers(mlog):
+    '''
+    Function to read the marker file of a proposal, which holds the archive markers
+    from Archive_Markers and the fingerprint from Proposal_Fingerprint as of the last
+    complete run, and return them as a dictionary and a string (None if missing).
+    '''
+
+    markers = {}
+    fingerprint = None
+
+    if os.path.exists(mlog):
+        with open(mlog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        if len(col) == 2 and col[0] == 'fingerprint':
+                            fingerprint = col[1]
+                        elif len(col) == 3:
+                            markers[col[0]] = (col[1], col[2])
+
+    return markers, fingerprint
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_MARKERS
+#
+##################################################################################
+
+def Write_Markers(mlog,markers,fingerprint):
+    '''
+    Function to write the marker file of a proposal through a temporary file which is
+    then renamed over it.
+    '''
+
+    with open(mlog + '.temp','w') as outfile:
+        outfile.write("# Obstype" + "     " + "Frame count" + "     " + "Newest DATE_OBS" +
+                      "\n")
+        outfile.write("fingerprint" + "     " + fingerprint + "\n")
+        for items in sorted(markers):
+            outfile.write(items + "     " + markers[items][0] + "     " + markers[items][1] +
+                          "\n")
+
+    os.rename(mlog + '.temp', mlog)
+
+
+##################################################################################
+#
+# FUNCTION: PROPOSAL_FINGERPRINT
+#
+##################################################################################
+
+def Proposal_Fingerprint(info,proposal,allocations):
+    '''
+    Function to return the MD5 fingerprint of what the result of a run depends on
+    besides the frames in the archive: the archive query of the proposal, its time
+    allocations and the size and inode of its Catalog, TimeLog and TimeLog database
+    files. A change to any of them makes the fast check run the proposal again.
+    '''
+
+    md5 = hashlib.md5()
+    md5.update(Frame_Query(info, info['date_start'], info['rlevel'], proposal,
+                           info['obstype']).encode())
+    md5.update(repr(allocations).encode())
+
+    for filename in [info['downloadlog_directory'] + '/Catalog_' + proposal + '.txt',
+                     info['timelog_directory'] + '/TimeLog_' + proposal + '.txt',
+                     info['timelog_directory'] + '/TimeLog_' + proposal + '.db']:
+        if os.path.exists(filename):
+            stat = os.stat(filename)
+            md5.update((filename + " " + str(stat.st_size) + " " +
+                        str(stat.st_ino) + "\n").encode())
+
+    return md5.hexdigest()
+
+
+##################################################################################
+#
+# FUNCTION: QUERY_FRAMES
+#
+##################################################################################
+
+def Query_Frames(session,query,auth):
+    '''
+    Generator to go through all the frames returned by an archive query. The archive
+    returns its results one page at a time, so after the frames of a page have been
+    yielded the 'next' link of the page is followed until there is no page left.
+    Get_Data queues the frames of a page for download as they are yielded, so they are
+    downloaded while the next page is requested.
+    '''
+
+    url = query
+
+    while url:
+        response = session.get(url, auth = auth)
+        response.raise_for_status()
+        page = response.json()
+        for frame in page['results']:
+            yield frame
+        url = page.get('next')
+
+
+##################################################################################
+#
+# CLASS: DOWNLOAD_QUEUE
+#
+##################################################################################
+
+class Download_Queue(object):
+    '''
+    Priority queue of the frames waiting to be downloaded, shared by the worker threads
+    of Get_Data. Frames are taken by their obstype in the priority list (obstypes not
+    in the list come last), then by group, the group with the newest frame first, then
+    the newest frame first. The group of a frame is its request number from the
+    archive, or the frame itself if there is none. As frames are queued while the
+    archive is still being paged through, a group is ranked by the newest of its frames
+    queued so far. The time the first frame was queued is kept in started.
+    '''
+
+    def __init__(self,priority):
+        self.priority = priority
+        self.heap = []
+        self.groups = {}
+        self.count = 0
+        self.started = None
+        self.lock = threading.Lock()
+
+    def put(self,items,frame):
+        '''
+        Queue a frame of the given obstype.
+        '''
+
+        group = str(frame.get('REQNUM', frame['filename']))
+        date_obs = Date_Number(frame.get('DATE_OBS'))
+
+        with self.lock:
+            if self.started is None:
+                self.started = clock.time()
+            self.groups[group] = max(self.groups.get(group, date_obs), date_obs)
+            rank = (self.priority.index(items) if items in self.priority
+                    else len(self.priority))
+            heapq.heappush(self.heap, (rank, -self.groups[group], group, -date_obs,
+                                       self.count, frame))
+            self.count = self.count + 1
+
+    def get(self):
+        '''
+        Take the most urgent frame from the queue.
+        '''
+
+        with self.lock:
+            return heapq.heappop(self.heap)[-1]
+
+
+##################################################################################
+#
+# FUNCTION: DATE_NUMBER
+#
+##################################################################################
+
+def Date_Number(date_obs):
+    '''
+    Function to turn an archive DATE_OBS into a number that sorts in the same order,
+    for instance 2016-05-10T01:02:03 into 20160510010203. A missing date gives 0.
+    '''
+
+    return int(re.sub('[^0-9]', '', (date_obs or '')[0:19]) or 0)
+
+
+##################################################################################
+#
+# FUNCTION: FETCH_NEXT
+#
+##################################################################################
+
+def Fetch_Next(queue,path,chunk_size,session,checksum_index):
+    '''
+    Function run by the worker threads in Get_Data to take the most urgent frame from
+    the download queue and get it into the given directory with Fetch_Frame. Returns
+    the file name of the frame with the result of Fetch_Frame and None, or with None
+    and the error if it failed.
+    '''
+
+    frame = queue.get()
+
+    try:
+        return frame['filename'], Fetch_Frame(frame, path + '/' + frame['filename'],
+                                              chunk_size, session, checksum_index), None
+    except Exception as e:
+        return frame['filename'], None, e
+
+
+##################################################################################
+#
+# FUNCTION: MOVE_FRAME
+#
+##################################################################################
+
+def Move_Frame(source,directory,checksum = None,chunk_size = 1048576):
+    '''
+    Function to move one frame into the given directory. It is run by the worker
+    threads of the move stage in Get_Data. On the same device the frame is hard-linked
+    into place and then removed, which is atomic and never replaces an existing file.
+    Across devices it is copied to a .part file in the directory named after the
+    process and thread, flushed to disk and hard-linked into place in the same way. If
+    a frame of that name is already there, the frame is removed when the two are
+    identical, and otherwise moved under a versioned name (.v2, .v3, ...). Returns the destination, what was done ('renamed', 'copied', 'identical' or
+    'versioned'), the MD5 checksum of the frame if it is known, and the time taken.
+    '''
+
+    start = clock.time()
+    name = os.path.basename(source)
+    root, ext = name.split('.', 1)
+    same_device = os.stat(source).st_dev == os.stat(directory).st_dev
+    version = 1
+
+    while True:
+        if version == 1:
+            dest = os.path.join(directory, name)
+        else:
+            dest = os.path.join(directory, root + '.v' + str(version) + '.' + ext)
+
+        # Compare with the frame already there, first by size and then by checksum.
+
+        if os.path.exists(dest):
+            if os.path.getsize(dest) == os.path.getsize(source):
+                if checksum is None:
+                    checksum = File_Checksum(source, chunk_size)
+                if File_Checksum(dest, chunk_size) == checksum:
+                    os.remove(source)
+                    return dest, 'identical', checksum, clock.time() - start
+            version = version + 1
+            continue
+
+        if same_device:
+            try:
+                os.link(source, dest)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    continue
+                if e.errno not in [errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                    raise
+                os.rename(source, dest)
+            else:
+                os.remove(source)
+            action = 'renamed'
+        else:
+            part = (dest + '.' + str(os.getpid()) + '.' +
+                    str(threading.current_thread().ident) + '.part')
+            try:
+                with open(source,'rb') as infile:
+                    with open(part,'wb') as outfile:
+                        shutil.copyfileobj(infile, outfile, chunk_size)
+                        outfile.flush()
+                        os.fsync(outfile.fileno())
+                try:
+                    os.link(part, dest)
+                except OSError as e:
+                    if e.errno == errno.EEXIST:
+                        os.remove(part)
+                        continue
+                    if e.errno not in [errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                        raise
+                    os.rename(part, dest)
+                else:
+                    os.remove(part)
+            except Exception:
+                if os.path.exists(part):
+                    os.remove(part)
+                raise
+            os.remove(source)
+            action = 'copied'
+
+        if version > 1:
+            action = 'versioned'
+
+        return dest, action, checksum, clock.time() - start
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_MANIFEST
+#
+##################################################################################
+
+def Write_Manifest(manifest_file,manifest):
+    '''
+    Function to write the manifest of a batch of frames moved to the final directories,
+    one line per frame with its path, how it was moved and its checksum. The manifest
+    is written to a temporary file and renamed, so it only appears once it is complete.
+    '''
+
+    with open(manifest_file + '.tmp','w') as outfile:
+        outfile.write("##### GetData Manifest File #####" + "\n" + "\n")
+        outfile.write("# Frame" + "     " + "Action" + "     " + "Checksum" + "\n")
+        for dest, action, checksum in manifest:
+            outfile.write(dest + "     " + action + "     " + str(checksum) + "\n")
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+
+##################################################################################
+#
+# FUNCTION: READ_CHECKSUMS
+#
+##################################################################################
+
+def Read_Checksums(xlog):
+    '''
+    Function to read the checksum index, which lists the MD5 checksum and the path of
+    every frame moved to the final directories, and return it as a dictionary from
+    checksum to path.
+    '''
+
+    checksum_index = {}
+
+    if os.path.exists(xlog):
+        with open(xlog,'r') as infile:
+            for line in infile:
+                if not line.startswith('#'):
+                    if not line.startswith('\n'):
+                        col = line.split()
+                        checksum_index[col[0]] = col[1]
+
+    return checksum_index
+
+
+##################################################################################
+#
+# FUNCTION: WRITE_CHECKSUM
+#
+##################################################################################
+
+def Write_Checksum(xlog,checksum,path):
+    '''
+    Function to add the checksum and path of a frame to the checksum index.
+    '''
+
+    with index_lock:
+        with open(xlog,'a') as outfile:
+            outfile.write(checksum + "     " + path + "\n")
+
+
+##################################################################################
+#
+# FUNCTION: FILE_CHECKSUM
+#
+##################################################################################
+
+def File_Checksum(filename,chunk_size = 1048576):
+    '''
+    Function to compute the MD5 checksum of a file, reading it in chunks.
+    '''
+
+    md5 = hashlib.md5()
+
+    with open(filename,'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+##################################################################################
+#
+# FUNCTION: FETCH_FRAME
+#
+##################################################################################
+
+def Fetch_Frame(frame,filename,chunk_size,session,checksum_index):
+    '''
+    Function run by Fetch_Next in the worker threads of Get_Data to get one frame into
+    the given file. If the archive gives the MD5 checksum of the frame and a frame with
+    the same checksum is already in the checksum index (under another rlevel or
+    proposal), and that file still has this checksum, the file is hard-linked instead
+    of downloaded. Otherwise the frame is downloaded and checked against the archive
+    checksum. Returns the header blocks, the checksum, the path linked to (or None)
+    and the time taken in seconds.
+    '''
+
+    start = clock.time()
+    checksum = None
+    if frame.get('version_set'):
+        checksum = frame['version_set'][0].get('md5')
+    checksum = frame.get('md5', checksum)
+
+    source = checksum_index.get(checksum)
+    if source is not None and os.path.exists(source):
+        if File_Checksum(source, chunk_size) == checksum:
+            try:
+                os.link(source, filename)
+                return None, checksum, source, clock.time() - start
+            except OSError as e:
+                if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+
+    blocks, checksum = Download_Frame(frame['url'], filename, chunk_size, session, checksum)
+
+    return blocks, checksum, None, clock.time() - start
+
+
+##################################################################################
+#
+# FUNCTION: DOWNLOAD_FRAME
+#
+##################################################################################
+
+def Download_Frame(url,filename,chunk_size = 1048576,session = requests,checksum = None):
+    '''
+    Function to download a single frame from the archive into the given file. It is
+    run by the worker threads in Get_Data. The frame is streamed in chunks of
+    chunk_size bytes into a temporary .part file, which is flushed to disk and then
+    renamed to the frame name, so a frame file only ever appears once it is complete.
+    If the download fails, the .part file is removed before the error is raised again.
+    The primary header blocks are kept from the first chunks as they stream past and
+    are returned, so the time calculation does not have to read the frame again; None
+    is returned if the END card was not found in the first 100 blocks. The MD5
+    checksum of the frame is computed on the way too and returned with the header
+    blocks; if the expected checksum is given and does not match, the download is
+    treated as broken. With an Archive_Session, a broken download is started again
+    after a backoff, up to the number of retries of the session, and the chunks are
+    read no faster than the bandwidth limit of the session allows.
+    '''
+
+    part = filename + '.part'
+    attempt = 0
+    bandwidth = getattr(session, 'bandwidth', None)
+
+    while True:
+        head = b''
+        blocks = None
+        md5 = hashlib.md5()
+        try:
+            response = session.get(url, stream = True)
+            try:
+                response.raise_for_status()
+                with open(part,'wb') as f:
+                    for chunk in response.iter_content(chunk_size = chunk_size):
+                        if bandwidth is not None:
+                            bandwidth.consume(len(chunk))
+                        f.write(chunk)
+                        md5.update(chunk)
+                        if blocks is None and len(head) < 100 * 2880:
+                            head = head + chunk
+                            end = Header_End(head)
+                            if end is not None:
+                                blocks = head[:end]
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                response.close()
+            if checksum is not None and md5.hexdigest() != checksum:
+                raise Checksum_Error("Checksum of " + os.path.basename(filename) +
+                                     " is " + md5.hexdigest() + ", expected " + checksum)
+            os.rename(part, filename)
+            return blocks, md5.hexdigest()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError, Checksum_Error):
+            if os.path.exists(part):
+                os.remove(part)
+            if attempt >= getattr(session, 'retries', 0):
+                raise
+            session.backoff_wait(attempt)
+            attempt = attempt + 1
+        except Exception:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+
+
+##################################################################################
+#
+# CLASS: CHECKSUM_ERROR
+#
+##################################################################################
+
+class Checksum_Error(IOError):
+    '''
+    Error raised when a downloaded frame does not match the checksum from the archive.
+    '''
+
+
+##################################################################################
+#
+# CLASS: DAEMON_STATUS
+#
+##################################################################################
+
+class Daemon_Status(object):
+    '''
+    Status of the daemon, updated by its main loop and read by the health server
+    thread, so both go through a lock.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = {'pid': os.getpid(), 'started': time, 'state': 'starting',
+                       'cycles': 0, 'last_result': None}
+
+    def update(self,**fields):
+        with self.lock:
+            self.status.update(fields)
+
+    def get(self,name):
+        with self.lock:
+            return self.status.get(name)
+
+    def copy(self):
+        with self.lock:
+            return dict(self.status)
+
+
+##################################################################################
+#
+# CLASS: HEALTH_HANDLER
+#
+##################################################################################
+
+class Health_Handler(BaseHTTPRequestHandler):
+    '''
+    Handler of the health server: any GET returns the status of the daemon as JSON,
+    with status code 200, or 503 if the last cycle failed.
+    '''
+
+    def do_GET(self):
+        status = self.server.status.copy()
+        body = json.dumps(status, sort_keys = True).encode()
+        if status.get('last_result') == 'error':
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+
+##################################################################################
+#
+# FUNCTION: HEALTH_SERVER
+#
+##################################################################################
+
+def Health_Server(port,status):
+    '''
+    Function to start the health server of the daemon on the given port of localhost
+    in a background thread, serving the given Daemon_Status.
+    '''
+
+    server = HTTPServer(('127.0.0.1', port), Health_Handler)
+    server.status = status
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+##################################################################################
+#
+# FUNCTION: CONFIG_PATH
+#
+##################################################################################
+
+def Config_Path():
+    '''
+    Function to return the path of the Config_GetData file.
+    '''
+
+    return os.path.join(os.path.expanduser('~'), '.obscontrol',
+                        'Config_GetData_Microlensing.txt')
+
+
+##################################################################################
+#
+# FUNCTION: GET_CONFIG
+#
+##################################################################################
+
+def Get_Config():
+    '''
+    Function to read the key parameters from the Config_GetData file to feed as
+    inputs for Get_Data function. It returns a list containing all key parameters.
+    '''
+
+    ConfigPath = Config_Path()
+    
+    param = {}
+    
+    with open(ConfigPath,'r') as infile:
+        for line in infile:
+            if not line.startswith('#'):
+                if not line.startswith('\n'):
+                    col = line.split()
+                    param[col[0]] = col[1]
+
+    return param
+
+
+##################################################################################
+# COMMANDLINE RUN SECTION
+'''
+Run the above script from the Linux command line. It calls Get_Config() first, then
+Get_Data() and finally calls Output_HTML(). Run it with the argument 'compact' to sort
+the TimeLog file of every proposal in the config file that no run is working on back
+into groups instead, with 'daemon' to keep running and poll the archive by itself, or
+with 'benchmark' to time runs of the script.
+'''
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compact':
+        info = Get_Config()
+        for items in info['proposal'].split(','):
+            tlog = info['timelog_directory'] + '/TimeLog_' + items + '.txt'
+            if not os.path.exists(tlog):
+                continue
+
+            # A run working on the proposal appends to its TimeLog, so the proposal
+            # is skipped while its lock is held.
+
+            lock = Proposal_Lock(info['downloadlog_directory'] + '/GetData_' + items +
+                                 '.lock', float(info.get('lock_ttl(s)', 3600)))
+            if not lock.acquire():
+                print("Proposal " + items + " is locked by process " +
+                      str(lock.holder()[0]) + ", skipping.")
+                continue
+            try:
+                Compact_TimeLog(tlog)
+            finally:
+                lock.release()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'daemon':
+        Daemon()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        Benchmark()
+    else:
+        Execute()